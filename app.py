@@ -1,23 +1,69 @@
 """
 OpenBNF
 """
-import difflib
+import base64
 import functools
 import json
+import logging
 import os
 import re
 
 from flask import Flask, abort, request, redirect, Response, make_response
-from flask import render_template
+import flask
 import jinja2
 from jinja2 import evalcontextfilter, Markup, escape
+from werkzeug.urls import url_encode
 
-from db import db
+import cache
+import dataset
+import metrics
+import query
+import settings
+import store
 
 app = Flask(__name__)
-app.debug = True
+app.debug = settings.DEBUG
 
-NAMES = [d['name'] for d in db.drugs.find()]
+# Drugs are keyed by name throughout: it is what the indexes return,
+# and what we fetch documents by. The indexes are rebuilt in the
+# background whenever a new dataset is loaded.
+DATASET = dataset.LiveDataset(ttl=settings.DATASET_VERSION_TTL, lazy=settings.LAZY_INDEXES)
+
+def current():
+    """
+    Return the Dataset this request is answered from. It is the same one
+    for the whole request, and documents are read from its source, so
+    ids from the indexes always name documents we can fetch.
+    """
+    data = getattr(flask.g, 'dataset', None)
+    if data is None:
+        data = flask.g.dataset = DATASET.get()
+    return data
+
+# Emptied whenever a new Dataset is swapped in. Asking for its version
+# is what prompts DATASET to check the store, so no TTL is needed here.
+RESPONSES = cache.VersionedCache(
+    settings.RESPONSE_CACHE_BYTES, lambda: DATASET.get().version,
+    ttl=0, sizeof=lambda r: len(r[0]))
+
+def cache_lookups():
+    "Hits and misses of every in-process cache, for /metrics"
+    current = DATASET.current
+    caches = [('responses', RESPONSES)]
+    if current is not None:
+        caches += [('autocomplete', current.autocomplete.memo),
+                   ('suggestions', current.suggestions.memo)]
+    return [({'cache': name, 'result': result}, getattr(c, attr))
+            for name, c in caches
+            for result, attr in [('hit', 'hits'), ('miss', 'misses')]]
+
+metrics.Collected('openbnf_cache_requests_total',
+                  'Lookups in the in-process caches, by cache and result',
+                  'counter', ('cache', 'result'), cache_lookups)
+
+if not metrics.log.handlers:
+    metrics.log.addHandler(logging.StreamHandler())
+    metrics.log.setLevel(logging.INFO)
 
 def include_file(name):
     return jinja2.Markup(loader.get_source(env, name)[0])
@@ -41,20 +87,16 @@ def nl2br(eval_ctx, value):
         result = Markup(result)
     return result
 
+def render_template(tplname, **context):
+    with metrics.timed(metrics.RENDER_SECONDS, template=tplname):
+        return flask.render_template(tplname, **context)
+
 def json_template(tplname, **context):
     return Response(
         render_template(tplname,**context),
         mimetype='application/json'
         )
 
-def without_oid(fn):
-    def wrapper(*args, **kwargs):
-        results = fn(*args, **kwargs)
-        for i in range(len(results)):
-            del results[i]['_id']
-        return results
-    return wrapper
-
 def jsonp(fn):
     @functools.wraps(fn)
     def with_callback_maybe(*args,**kwargs):
@@ -66,29 +108,183 @@ def jsonp(fn):
             return Response(results, mimetype='application/json')
     return with_callback_maybe
 
+def cached(fn):
+    """
+    Serve GET responses from RESPONSES for as long as the dataset
+    version is unchanged.
+
+    Responses carry a strong ETag derived from the dataset version and
+    the request URL, so clients revalidating an unchanged page get a
+    304 without us touching the database or rendering anything.
+    Streamed and non-200 responses are passed through uncached.
+    """
+    @functools.wraps(fn)
+    def from_cache_maybe(*args, **kwargs):
+        if request.method != 'GET':
+            return fn(*args, **kwargs)
+        key = request.path
+        if request.query_string:
+            key = '{0}?{1}'.format(key, request.query_string)
+        etag = RESPONSES.etag(key)
+        headers = [
+            ('ETag', '"{0}"'.format(etag)),
+            ('Cache-Control', 'public, max-age={0}'.format(settings.CACHE_MAX_AGE))
+            ]
+        if request.if_none_match.contains(etag):
+            return Response(status=304, headers=headers)
+
+        hit = RESPONSES.get(key)
+        if hit is None:
+            response = make_response(fn(*args, **kwargs))
+            if response.status_code != 200 or response.is_streamed:
+                return response
+            extra = [(k, v) for k, v in response.headers
+                     if k not in ('Content-Type', 'Content-Length')]
+            hit = (response.data, response.mimetype, extra)
+            RESPONSES.set(key, hit)
+        data, mimetype, extra = hit
+        return Response(data, headers=extra + headers, mimetype=mimetype)
+    return from_cache_maybe
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(str(offset))
+
+def decode_cursor(cursor):
+    try:
+        offset = int(base64.urlsafe_b64decode(str(cursor)))
+    except (TypeError, ValueError):
+        abort(400)
+    # We never hand out a negative offset, and slicing with one would
+    # serve the tail of the results
+    if offset < 0:
+        abort(400)
+    return offset
+
+def paginated(fn):
+    """
+    For API views that return an ordered list of drug ids.
+
+    Serve one page of the drugs, chosen by the `limit` and `cursor`
+    (or `offset`) query arguments, and point at the next page with
+    `Link` and `X-Next-Cursor` headers.
+
+    With `stream=1` the page (the whole result when no `limit` is given)
+    is written out as a JSON array, or JSONP call, as it is fetched from
+    the database in batches. With `format=ndjson` it is written one drug
+    per line. Either way only one batch is held in memory at a time.
+    """
+    @functools.wraps(fn)
+    def with_pages(*args, **kwargs):
+        ids = fn(*args, **kwargs)
+        ndjson = request.args.get('format') == 'ndjson'
+        stream = ndjson or request.args.get('stream', '') not in ('', '0')
+
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        if request.args.get('cursor'):
+            offset = decode_cursor(request.args['cursor'])
+        limit = request.args.get('limit', None, type=int)
+        if limit is None and not stream:
+            limit = settings.API_PAGE_SIZE
+        if limit is not None:
+            limit = max(limit, 1)
+            if not stream:
+                limit = min(limit, settings.API_MAX_PAGE_SIZE)
+            page = ids[offset:offset + limit]
+        else:
+            page = ids[offset:]
+
+        headers = {}
+        if offset + len(page) < len(ids):
+            nextargs = request.args.copy()
+            nextargs.pop('offset', None)
+            nextargs['cursor'] = encode_cursor(offset + len(page))
+            headers['X-Next-Cursor'] = nextargs['cursor']
+            headers['Link'] = '<{0}?{1}>; rel="next"'.format(
+                request.base_url, url_encode(nextargs))
+
+        callback = request.args.get('callback', None)
+        # generate() runs after the request context has gone
+        data = current()
+        if not stream:
+            results = json.dumps(list(iter_drugs(page, data)))
+            if callback:
+                results = '{0}({1})'.format(callback, results)
+            return Response(results, headers=headers, mimetype='application/json')
+
+        def generate():
+            if ndjson:
+                for drug in iter_drugs(page, data):
+                    yield json.dumps(drug) + '\n'
+                return
+            if callback:
+                yield '{0}('.format(callback)
+            yield '['
+            for i, drug in enumerate(iter_drugs(page, data)):
+                yield (', ' if i else '') + json.dumps(drug)
+            yield ']'
+            if callback:
+                yield ')'
+        mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+        return Response(generate(), headers=headers, mimetype=mimetype)
+    return with_pages
+
 """
 Search
 """
-@without_oid
-def drugs_like_me(term):
+def drug_ids_like_me(term):
+    """
+    Return the ids (names) of Drugs that are like our search term,
+    in index order. This never touches the database.
+
+    See query.py for the search syntax.
+    """
+    return query.search(term, current().name_index)
+
+def fetch_drugs(ids, data=None):
+    """
+    Fetch the Drugs with IDS in one round trip, preserving the order of IDS,
+    from the source of DATA (by default, this request's Dataset).
+    """
+    return store.drugs_by_name(ids, source=(data or current()).source)
+
+def iter_drugs(ids, data=None):
+    """
+    Yield the Drugs with IDS, in order, fetching them from the
+    database settings.STREAM_BATCH_SIZE at a time.
+    """
+    for i in xrange(0, len(ids), settings.STREAM_BATCH_SIZE):
+        for drug in fetch_drugs(ids[i:i + settings.STREAM_BATCH_SIZE], data):
+            yield drug
+
+def drugs_like_me(term, offset=0, limit=None):
     """
     Return a list of Drugs that are like our search term.
     (For some value of like)
+
+    Only the page of OFFSET:OFFSET+LIMIT matches is fetched.
     """
-    splitter = None
-    for splittee in ['|', ' OR ']:
-        if term.find(splittee) != -1:
-            splitter = splittee
-            break
+    ids = drug_ids_like_me(term)[offset:]
+    if limit is not None:
+        ids = ids[:limit]
+    return fetch_drugs(ids)
 
-    if splitter:
-        results = []
-        frist, rest = term.split(splitter, 1)
-        results = drugs_like_me(frist)
-        results += drugs_like_me(rest);
-        return results
+def drug_ids_mentioning(term, fields):
+    """
+    Return the ids (names) of Drugs whose FIELDS best match TERM, most relevant first.
+    """
+    text_index = current().text_index
+    if text_index is None:
+        return store.search_text(term, fields, source=current().source)
+    return [i for i, score in text_index.search(term, fields)]
 
-    return [d for d in db.drugs.find({'name': {'$regex': term, '$options':'i'}})]
+def paging(default, maximum):
+    """
+    Return the (offset, limit) requested in the query string,
+    clamped to sane values.
+    """
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', default, type=int)
+    return offset, min(max(limit, 1), maximum)
 
 def drugs_quite_close(drug):
     """
@@ -97,15 +293,41 @@ def drugs_quite_close(drug):
 
     Perform a fuzzy match and return that.
     """
-    wholeterm = difflib.get_close_matches(drug.upper(), NAMES)
-    fristword = difflib.get_close_matches(drug.split()[0].upper(), NAMES)
-    print 'wholeterm', wholeterm
-    print 'fristword', fristword
+    if not drug.split():
+        return []
+    suggestions = current().suggestions
+    suggest = lambda x: suggestions.suggest(x, n=settings.SUGGEST_LIMIT,
+                                            cutoff=settings.SUGGEST_CUTOFF)
+    with metrics.timed(metrics.SUGGEST_SECONDS):
+        wholeterm = suggest(drug)
+        fristword = suggest(drug.split()[0])
+    metrics.annotate(wholeterm=wholeterm, fristword=fristword)
     return list(set(wholeterm + fristword))
 
+"""
+Instrumentation
+"""
+@app.before_request
+def start_request():
+    metrics.start_request()
+
+@app.after_request
+def finish_request(response):
+    metrics.finish_request(request.endpoint or 'unmatched', request.method, request.path, response.status_code)
+    return response
+
+@app.teardown_request
+def fail_request(exc):
+    # Only still running if after_request never saw a response
+    metrics.finish_request(request.endpoint or 'unmatched', request.method, request.path, 500)
+
 """
 Views
 """
+@app.route("/metrics")
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route("/")
 def index():
     return render_template('index.html')
@@ -115,30 +337,38 @@ def about():
     return render_template('about.html')
 
 @app.route("/search", methods = ['GET', 'POST'])
+@cached
 def search():
     if request.method == 'POST':
         drug = request.form.get('q', '')
     else:
         drug = request.args.get('q', '')
 
-    print 'Query is ', drug
+    metrics.annotate(query=drug)
 
-    results = drugs_like_me(drug)
+    offset, limit = paging(settings.SEARCH_PAGE_SIZE, settings.SEARCH_MAX_PAGE_SIZE)
 
-    if len(results) == 1 and results[0]['name'].lower() == drug.lower():
-        return redirect('/result/{0}'.format(results[0]['name']))
+    ids = drug_ids_like_me(drug)
+    # Decided from the index, whatever page was asked for. Offsets past
+    # the end get an empty page.
+    if len(ids) == 1 and ids[0].lower() == drug.lower():
+        return redirect('/result/{0}'.format(ids[0]))
+    results = fetch_drugs(ids[offset:offset + limit])
     suggestions = []
-    if not results:
+    if not ids:
         suggestions = drugs_quite_close(drug)
-    return render_template('search.jinja2', results=results, query=drug, suggestions=suggestions)
+    return render_template('search.jinja2', results=results, query=drug, suggestions=suggestions,
+                           total=len(ids), offset=offset, limit=limit)
 
-@app.route("/result/<drug>")
+# Some drug names contain a slash, e.g. NORADRENALINE/NOREPINEPHRINE
+@app.route("/result/<path:drug>")
+@cached
 def result(drug):
 
-    drug = db.drugs.find_one({'name': drug})
-
-    del drug['_id']
-    whitelist = ['doses', 'contra-indications', 'interactions', 'name', 'breadcrumbs', 'fname']
+    drug = store.drug_by_name(drug, source=current().source)
+    if not drug:
+        abort(404)
+    whitelist = ['doses', 'contra-indications', 'interactions', 'name', 'breadcrumbs', 'fname', 'codes', 'xrefs']
     impairments = [k for k in drug if k.find('impairment')!= -1]
     whitelist += impairments
     return render_template('result.html', drug=drug,
@@ -149,11 +379,11 @@ def jstesting():
     return env.get_template('jstest.html').render()
 
 @app.route('/ajaxsearch', methods = ['GET'])
+@cached
 def ajaxsearch():
     term = request.args.get('term')
     term = term.replace('+',  ' ')
-    responses = drugs_like_me(term)[:10]
-    responses = [n['name'] for n in responses]
+    responses = current().autocomplete.complete(term, limit=settings.AUTOCOMPLETE_LIMIT)
     if len(responses) > 0:
         return json.dumps(responses)
     return json.dumps(drugs_quite_close(term))
@@ -184,51 +414,148 @@ def apidoc_indication_endpoint():
 def apidoc_sideeffects_endpoint():
     return json_template('api/sideeffects.json.js', host=request.host)
 
+@app.route('/api/v2/openbnf/sections')
+def apidoc_sections_endpoint():
+    return json_template('api/sections.json.js', host=request.host)
+
+@app.route('/api/v2/openbnf/interactions')
+def apidoc_interactions_endpoint():
+    return json_template('api/interactions.json.js', host=request.host)
+
 @app.route('/api/v2/doc')
 def apidoc():
     return env.get_template('apidoc.html').render()
 
 @app.route('/api/v2/drug/<code>')
+@cached
 @jsonp
 def api_v2_drug_bnf_code(code):
-    codemap = db.codes.find_one({'code': code})
-    if not codemap:
-        abort(404)
-    drug = db.drugs.find_one({'name': codemap['name']})
+    drug = store.drug_by_code(code, source=current().source)
     if not drug:
         abort(404)
-    del drug['_id']
     return drug
 
-@app.route('/api/v2/drug')
+def requested_values(key):
+    """
+    Return the values of KEY asked for in a batch request, de-duplicated
+    and in order. They may come as a comma separated query or form
+    argument, or as a JSON body: either a list or {KEY: [...]}.
+    """
+    if request.method == 'POST' and request.mimetype == 'application/json':
+        body = request.json
+        values = body.get(key, []) if isinstance(body, dict) else body
+        if not isinstance(values, list):
+            abort(400)
+    else:
+        values = request.values.get(key, '').split(',')
+    seen = set()
+    unique = []
+    for value in values:
+        value = unicode(value).strip()
+        if value and value not in seen:
+            seen.add(value)
+            unique.append(value)
+    return unique
+
+def requested_codes():
+    "Return the BNF codes asked for in a batch request"
+    return requested_values('codes')
+
+@app.route('/api/v2/drugs', methods=['GET', 'POST'])
+@cached
+@jsonp
+def api_v2_drugs_bnf_codes():
+    """
+    Resolve a batch of BNF codes with a single query.
+    Codes we can't resolve map to null.
+    """
+    codes = requested_codes()
+    if not codes:
+        abort(400)
+    if len(codes) > settings.MAX_BATCH_CODES:
+        abort(413)
+    drugs = store.drugs_by_code(codes, source=current().source)
+    return dict((code, drugs.get(code)) for code in codes)
+
+@app.route('/api/v2/interactions', methods=['GET', 'POST'])
+@cached
 @jsonp
+def api_v2_interactions():
+    """
+    Check a list of drugs, given by name and/or BNF code, for
+    interactions with each other. Answered entirely from the in-process
+    interaction index.
+
+    A dataset without any interaction tables gets a 503: an empty list
+    would read as "these don't interact".
+    """
+    data = current()
+    if not data.interactions.documented:
+        abort(503)
+    if request.method == 'POST' and request.mimetype == 'application/json':
+        if not isinstance(request.json, dict):
+            abort(400)
+    names, unresolved = [], []
+    for name in requested_values('drugs'):
+        found = data.byname.get(name.lower())
+        (names if found else unresolved).append(found or name)
+    for code in requested_values('codes'):
+        found = data.bycode.get(code)
+        (names if found else unresolved).append(found or code)
+    if not names and not unresolved:
+        abort(400)
+    if len(names) + len(unresolved) > settings.MAX_INTERACTION_DRUGS:
+        abort(413)
+    names = [n for i, n in enumerate(names) if n not in names[:i]]
+    return {
+        'drugs': names,
+        'unresolved': unresolved,
+        'interactions': [{'drugs': [a, b], 'severity': pair['severity'],
+                          'interaction': pair['interaction']}
+                         for a, b, pair in data.interactions.pairs(names)],
+        }
+
+@app.route('/api/v2/drug')
+@cached
+@paginated
 def api_v2_drug():
-    term = request.args.get('name')
-    return drugs_like_me(term)
+    term = request.args.get('name', '')
+    return drug_ids_like_me(term)
 
 @app.route('/api/v2/indication')
-@jsonp
+@cached
+@paginated
 def api_v2_indication():
-    term = request.args.get('indication')
-    resultz = [d for d in db.drugs.find({'indications': {'$regex': term, '$options':'i'}})]
+    term = request.args.get('indication', '')
+    resultz = drug_ids_mentioning(term, ['indications'])
     if not resultz:
         abort(404)
-    for i in range(len(resultz)):
-        del resultz[i]['_id']
     return resultz
 
 @app.route('/api/v2/sideeffects')
-@jsonp
+@cached
+@paginated
 def api_v2_sideeffects():
-    term = request.args.get('sideeffects')
-    resultz = [d for d in db.drugs.find({'side-effects': {'$regex': term, '$options':'i'}})]
+    term = request.args.get('sideeffects', '')
+    resultz = drug_ids_mentioning(term, ['side-effects'])
+    if not resultz:
+        abort(404)
+    return resultz
+
+@app.route('/api/v2/sections')
+@cached
+@paginated
+def api_v2_sections():
+    term = request.args.get('q', '')
+    sections = request.args.get('sections', '')
+    sections = [s for s in sections.split(',') if s in settings.TEXT_FIELDS]
+    resultz = drug_ids_mentioning(term, sections or settings.TEXT_FIELDS)
     if not resultz:
         abort(404)
-    for i in range(len(resultz)):
-        del resultz[i]['_id']
     return resultz
 
 if __name__ == '__main__':
+    # Flask's development server. Production runs wsgi.py under gunicorn.
     # Bind to PORT if defined, otherwise default to 5000.
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
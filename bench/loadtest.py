@@ -0,0 +1,318 @@
+"""
+Load test the web tier
+
+Builds a local stand-in for the database: an SQLite store (see
+sqlitestore.py) seeded from bnf.json and the names and codes in
+data/bnfcodes.json, with synthetic indications and side-effects, and
+optionally multiplied up with synthetic variants. Boots app.py against
+it, then drives a realistic mix of requests at each concurrency level
+in turn:
+
+    ajaxsearch   a name typed one keystroke at a time
+    search       /search for part of a name, sometimes misspelt
+    result       a drug page
+    drug         /api/v2/drug/<code>
+    indication   /api/v2/indication
+    sideeffects  /api/v2/sideeffects
+
+and reports requests per second and p50/p95/p99 latency per route.
+
+Save the results as a baseline with --save, and check a later run
+against one with --compare. The exit status is 1 if any route's p95 or
+throughput regressed by more than --tolerance.
+
+The response cache is off unless --cache is given, so that we measure
+the search path rather than the cache.
+
+Usage: python bench/loadtest.py [--scale N] [--concurrency 1,8,32]
+                                [--duration SECONDS] [--server werkzeug|gunicorn]
+                                [--workers N] [--cache]
+                                [--save FILE] [--compare FILE] [--tolerance F]
+"""
+import argparse
+import collections
+import copy
+import hashlib
+import httplib
+import json
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import settings
+import sqlitestore
+
+CONDITIONS = [u'pain', u'pyrexia', u'hypertension', u'angina', u'epilepsy', u'asthma',
+              u'infection', u'eczema', u'migraine', u'nausea', u'insomnia', u'gout']
+EFFECTS = [u'rash', u'nausea', u'headache', u'dizziness', u'diarrhoea', u'constipation',
+           u'drowsiness', u'oedema', u'hypotension', u'pruritus', u'tremor', u'fatigue']
+
+# (route, relative frequency)
+MIX = [
+    ('ajaxsearch', 40),
+    ('search', 20),
+    ('result', 20),
+    ('drug', 10),
+    ('indication', 5),
+    ('sideeffects', 5),
+    ]
+
+def corpus(scale, seed=1):
+    """
+    Return the stand-in drugs: bnf.json plus a drug for every name in
+    data/bnfcodes.json, with their codes and synthetic text sections,
+    SCALE times over.
+    """
+    rng = random.Random(seed)
+    drugs = json.loads(open(os.path.join(ROOT, 'bnf.json')).read()).values()
+    byname = dict((d['name'].strip().upper(), d) for d in drugs)
+    for codemap in json.loads(open(os.path.join(ROOT, 'data/bnfcodes.json')).read()):
+        name = codemap['name'].strip().upper()
+        if name not in byname:
+            byname[name] = {'name': name}
+        byname[name].setdefault('codes', []).append(codemap['code'])
+    base = []
+    for name in sorted(byname):
+        drug = byname[name]
+        drug.setdefault('indications', u'; '.join(rng.sample(CONDITIONS, 2)))
+        drug.setdefault('side-effects', u'; '.join(rng.sample(EFFECTS, 3)))
+        base.append(drug)
+    drugs = list(base)
+    for i in range(1, scale):
+        for drug in base:
+            variant = copy.deepcopy(drug)
+            variant['name'] = u'{0} {1}'.format(drug['name'], i)
+            variant['codes'] = [u'{0}-{1}'.format(c, i) for c in drug.get('codes', [])]
+            drugs.append(variant)
+    return drugs
+
+def build_store(directory, drugs):
+    "Write DRUGS to an SQLite store in DIRECTORY and return its path"
+    path = os.path.join(directory, 'openbnf.sqlite')
+    version = hashlib.sha1(json.dumps(drugs, sort_keys=True)).hexdigest()
+    sqlitestore.build(path, drugs, version, settings.TEXT_FIELDS)
+    return path
+
+def free_port():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+def serve(directory, port, args):
+    "Start the app against the store in DIRECTORY and wait until it answers"
+    env = dict(os.environ,
+               OPENBNF_STORE='sqlite',
+               OPENBNF_SQLITE=os.path.join(directory, 'openbnf.sqlite'),
+               OPENBNF_INDEXES=os.path.join(directory, 'openbnf.indexes'),
+               OPENBNF_LOG_SAMPLE='0',
+               PORT=str(port))
+    if not args.cache:
+        env['OPENBNF_RESPONSE_CACHE_BYTES'] = '0'
+    if args.server == 'gunicorn':
+        env['WEB_CONCURRENCY'] = str(args.workers)
+        command = ['gunicorn', '-c', 'gunicorn.conf.py', '--access-logfile', '', 'wsgi:application']
+    else:
+        command = [sys.executable, '-c',
+                   'from werkzeug.serving import run_simple; import app; '
+                   'run_simple("127.0.0.1", {0}, app.app, threaded=True)'.format(port)]
+    devnull = open(os.devnull, 'w')
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=devnull, stderr=devnull)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError('Server exited with {0}'.format(server.returncode))
+        try:
+            conn = httplib.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/about')
+            if conn.getresponse().status == 200:
+                return server
+        except (socket.error, httplib.HTTPException):
+            time.sleep(0.1)
+    server.terminate()
+    raise RuntimeError('Server did not start')
+
+def typo(rng, text):
+    i = rng.randrange(len(text))
+    return text[:i] + rng.choice('abcdefghijklmnopqrstuvwxyz') + text[i + 1:]
+
+def session(rng, drugs, route):
+    "Return the [(route, url)] a user of ROUTE requests"
+    drug = rng.choice(drugs)
+    name = drug['name']
+    quoted = lambda s: urllib.quote(s.encode('utf-8'), safe='')
+    if route == 'ajaxsearch':
+        typed = name[:rng.randint(3, max(3, min(len(name), 12)))]
+        return [(route, '/ajaxsearch?term=' + quoted(typed[:i]))
+                for i in range(1, len(typed) + 1)]
+    if route == 'search':
+        term = rng.choice(name.split())
+        if rng.random() < 0.2:
+            term = typo(rng, term)
+        return [(route, '/search?q=' + quoted(term))]
+    if route == 'result':
+        return [(route, '/result/' + quoted(name))]
+    if route == 'drug':
+        code = rng.choice(drug.get('codes') or [u'0000000X0'])
+        return [(route, '/api/v2/drug/' + quoted(code))]
+    if route == 'indication':
+        return [(route, '/api/v2/indication?indication=' + rng.choice(CONDITIONS))]
+    if route == 'sideeffects':
+        return [(route, '/api/v2/sideeffects?sideeffects=' + rng.choice(EFFECTS))]
+    raise ValueError(route)
+
+def user(port, drugs, seed, deadline, samples):
+    "Issue sessions until DEADLINE, appending (route, seconds, status) to SAMPLES"
+    rng = random.Random(seed)
+    routes = [r for r, weight in MIX for _ in range(weight)]
+    conn = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+    while time.time() < deadline:
+        for route, url in session(rng, drugs, rng.choice(routes)):
+            start = time.time()
+            try:
+                conn.request('GET', url)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (socket.error, httplib.HTTPException):
+                conn.close()
+                conn = httplib.HTTPConnection('127.0.0.1', port, timeout=30)
+                status = 0
+            samples.append((route, time.time() - start, status))
+    conn.close()
+
+def percentile(values, p):
+    "Nearest-rank Pth percentile of the sorted VALUES"
+    if not values:
+        return None
+    return values[max(int(math.ceil(p / 100.0 * len(values))), 1) - 1]
+
+def summarise(samples, elapsed):
+    "Return {route: stats} for SAMPLES, with 'all' for every route together"
+    byroute = collections.defaultdict(list)
+    errors = collections.defaultdict(int)
+    for route, seconds, status in samples:
+        for key in (route, 'all'):
+            byroute[key].append(seconds)
+            if not 200 <= status < 500:
+                errors[key] += 1
+    stats = {}
+    for route, latencies in byroute.items():
+        latencies.sort()
+        stats[route] = {
+            'requests': len(latencies),
+            'errors': errors[route],
+            'rps': len(latencies) / elapsed,
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            }
+    return stats
+
+def run_level(port, drugs, concurrency, duration):
+    samples = []
+    deadline = time.time() + duration
+    start = time.time()
+    users = [threading.Thread(target=user, args=(port, drugs, i, deadline, samples))
+             for i in range(concurrency)]
+    for t in users:
+        t.start()
+    for t in users:
+        t.join()
+    return summarise(samples, time.time() - start)
+
+def report(results):
+    for level in sorted(results, key=int):
+        print
+        print 'concurrency {0}'.format(level)
+        print '{0:12} {1:>8} {2:>7} {3:>9} {4:>9} {5:>9} {6:>9}'.format(
+            'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms')
+        for route, stats in sorted(results[level].items()):
+            print '{0:12} {1:>8} {2:>7} {3:>9.1f} {4:>9.2f} {5:>9.2f} {6:>9.2f}'.format(
+                route, stats['requests'], stats['errors'], stats['rps'],
+                stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000)
+
+def regressions(results, baseline, tolerance):
+    "Return a description of each way RESULTS are worse than BASELINE"
+    found = []
+    for level, routes in sorted(baseline['results'].items()):
+        for route, before in sorted(routes.items()):
+            after = results.get(level, {}).get(route)
+            if after is None:
+                continue
+            if after['p95'] > before['p95'] * (1 + tolerance):
+                found.append('concurrency {0} {1}: p95 {2:.2f} ms -> {3:.2f} ms'.format(
+                    level, route, before['p95'] * 1000, after['p95'] * 1000))
+            if after['rps'] < before['rps'] * (1 - tolerance):
+                found.append('concurrency {0} {1}: {2:.1f} -> {3:.1f} req/s'.format(
+                    level, route, before['rps'], after['rps']))
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description="Web tier load test")
+    parser.add_argument('--scale', type=int, default=1,
+                        help='Multiply the corpus with synthetic variants (e.g. 10, 100)')
+    parser.add_argument('--concurrency', default='1,8,32',
+                        help='Comma separated numbers of concurrent users to test')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='Seconds to run each concurrency level for')
+    parser.add_argument('--server', choices=['werkzeug', 'gunicorn'], default='werkzeug',
+                        help='Serve with threaded werkzeug, or gunicorn.conf.py')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--cache', action='store_true', help='Leave the response cache on')
+    parser.add_argument('--save', help='Write the results to this baseline file')
+    parser.add_argument('--compare', help='Compare the results with this baseline file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Fraction by which p95 or req/s may worsen before we fail')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='openbnf-loadtest-')
+    try:
+        drugs = corpus(args.scale)
+        build_store(directory, drugs)
+        print 'corpus: {0} drugs, server: {1}, cache: {2}'.format(
+            len(drugs), args.server, 'on' if args.cache else 'off')
+        port = free_port()
+        server = serve(directory, port, args)
+        try:
+            results = {}
+            for level in [int(c) for c in args.concurrency.split(',')]:
+                results[str(level)] = run_level(port, drugs, level, args.duration)
+        finally:
+            server.terminate()
+            server.wait()
+    finally:
+        shutil.rmtree(directory)
+
+    report(results)
+    config = {'scale': args.scale, 'server': args.server, 'cache': args.cache,
+              'duration': args.duration,
+              'workers': args.workers if args.server == 'gunicorn' else None}
+    if args.save:
+        with open(args.save, 'w') as fh:
+            fh.write(json.dumps({'config': config, 'results': results}, indent=2, sort_keys=True))
+    if args.compare:
+        baseline = json.loads(open(args.compare).read())
+        if baseline['config'] != config:
+            print
+            print 'Warning: baseline was run with {0}'.format(baseline['config'])
+        found = regressions(results, baseline, args.tolerance)
+        print
+        print '\n'.join(found) if found else 'No regressions against {0}'.format(args.compare)
+        return 1 if found else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
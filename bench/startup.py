@@ -0,0 +1,84 @@
+"""
+Benchmark cold start
+
+Time from starting a fresh Python process to it having served its
+first search, split into importing app.py and the first request. This
+is done for each way a worker can get its in-process indexes:
+
+    store     built by reading every drug from the store
+    artifact  unpickled from settings.INDEX_ARTIFACT
+    lazy      as artifact, but on the first request rather than at import
+
+The store (settings.STORE_BACKEND) and artifact must already be loaded;
+for a self-contained run use the SQLite store:
+
+    OPENBNF_STORE=sqlite python loadsqlite.py
+    OPENBNF_STORE=sqlite python bench/startup.py
+
+Usage: python bench/startup.py [--runs N] [--url URL]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = [
+    ('store', {'OPENBNF_INDEXES': ''}),
+    ('artifact', {}),
+    ('lazy', {'OPENBNF_LAZY_INDEXES': '1'}),
+    ]
+
+def child(url):
+    "Serve URL from a freshly imported app, and report when things happened"
+    imported = time.time()
+    sys.path.insert(0, ROOT)
+    import app
+    app.app.debug = False
+    ready = time.time()
+    response = app.app.test_client().get(url)
+    served = time.time()
+    print json.dumps({'imported': imported, 'ready': ready, 'served': served,
+                      'status': response.status_code})
+
+def run(url, env):
+    "Return (interpreter start, import, first request, total) seconds"
+    environ = dict(os.environ, **env)
+    start = time.time()
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', '--url', url], env=environ)
+    times = json.loads(output.strip().splitlines()[-1])
+    if times['status'] != 200:
+        raise RuntimeError('{0} returned {1}'.format(url, times['status']))
+    return (times['imported'] - start, times['ready'] - times['imported'],
+            times['served'] - times['ready'], times['served'] - start)
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start benchmark")
+    parser.add_argument('--runs', type=int, default=5,
+                        help='Processes to start for each mode')
+    parser.add_argument('--url', default='/search?q=para',
+                        help='First request to serve')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child(args.url)
+
+    # Make sure there is a current artifact to time
+    run(args.url, {})
+    print '{0:10} {1:>10} {2:>10} {3:>10} {4:>10}'.format(
+        'mode', 'python', 'import', 'first req', 'total')
+    for mode, env in MODES:
+        results = zip(*[run(args.url, env) for _ in range(args.runs)])
+        print '{0:10} {1:>8.1f}ms {2:>8.1f}ms {3:>8.1f}ms {4:>8.1f}ms'.format(
+            mode, *[median(r) * 1000 for r in results])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,105 @@
+"""
+Benchmark "did you mean" suggestions
+
+Compare the SuggestionIndex used by drugs_quite_close against the
+difflib.get_close_matches scan it replaced, over the drug names in
+bnf.json (plus the names in data/bnfcodes.json, so there is a
+realistically sized corpus), optionally multiplied up with synthetic
+variants.
+
+Agreement with difflib is reported over the whole list of suggestions
+(the top SUGGEST_LIMIT, as /search asks for) as well as the top hit.
+
+Usage: python bench/suggest.py [--scale N] [--queries N] [--candidates N]
+"""
+import argparse
+import difflib
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import indexes
+import settings
+
+def corpus(scale):
+    "Return the benchmark list of names, SCALE times over"
+    names = json.loads(open(os.path.join(ROOT, 'bnf.json')).read()).keys()
+    names += [c['name'] for c in
+              json.loads(open(os.path.join(ROOT, 'data/bnfcodes.json')).read())]
+    names = sorted(set(names))
+    scaled = list(names)
+    for i in range(1, scale):
+        scaled += [u'{0} {1}'.format(n, i) for n in names]
+    return scaled
+
+def typo(rng, name):
+    "Mangle NAME the way a hurried clinician on a phone might"
+    chars = list(name.lower())
+    for _ in range(rng.randint(1, 2)):
+        i = rng.randrange(len(chars))
+        op = rng.choice(['drop', 'swap', 'replace'])
+        if op == 'drop' and len(chars) > 3:
+            del chars[i]
+        elif op == 'swap' and i < len(chars) - 1:
+            chars[i], chars[i + 1] = chars[i + 1], chars[i]
+        else:
+            chars[i] = rng.choice('abcdefghijklmnopqrstuvwxyz')
+    return ''.join(chars)
+
+def timeit(fn, queries):
+    "Return (mean seconds per query, results) for FN over QUERIES"
+    results = []
+    start = time.time()
+    for q in queries:
+        results.append(fn(q))
+    return (time.time() - start) / len(queries), results
+
+def main():
+    parser = argparse.ArgumentParser(description="Suggestion benchmark")
+    parser.add_argument('--scale', type=int, default=1,
+                        help='Multiply the corpus with synthetic variants')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--candidates', type=int, default=settings.SUGGEST_CANDIDATES,
+                        help='Names to score exactly per query')
+    args = parser.parse_args()
+
+    names = corpus(args.scale)
+    rng = random.Random(args.seed)
+    queries = [typo(rng, rng.choice(names)) for _ in range(args.queries)]
+
+    start = time.time()
+    index = indexes.SuggestionIndex(names, max_candidates=args.candidates)
+    build = time.time() - start
+
+    upper = [n.upper() for n in names]
+    n, cutoff = settings.SUGGEST_LIMIT, settings.SUGGEST_CUTOFF
+    legacy, expected = timeit(
+        lambda q: difflib.get_close_matches(q.upper(), upper, n, cutoff), queries)
+    indexed, got = timeit(
+        lambda q: [x.upper() for x in index.suggest(q, n, cutoff)], queries)
+    # Second pass over the same queries is served from the memo.
+    repeated, _ = timeit(lambda q: index.suggest(q, n, cutoff), queries)
+    agree = sum(1 for e, g in zip(expected, got) if e == g)
+    agreetop = sum(1 for e, g in zip(expected, got) if e[:1] == g[:1])
+
+    print 'names:         {0}'.format(len(names))
+    print 'queries:       {0}'.format(len(queries))
+    print 'candidates:    {0}'.format(args.candidates)
+    print 'index build:   {0:.1f} ms'.format(build * 1000)
+    print 'difflib:       {0:.3f} ms/query'.format(legacy * 1000)
+    print 'index:         {0:.3f} ms/query'.format(indexed * 1000)
+    print 'index (burst): {0:.3f} ms/query'.format(repeated * 1000)
+    print 'speedup:       {0:.1f}x'.format(legacy / indexed)
+    print 'same top {0}:    {1}/{2} ({3:.1f}%)'.format(n, agree, len(queries),
+                                                  100.0 * agree / len(queries))
+    print 'same top hit:  {0}/{1}'.format(agreetop, len(queries))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
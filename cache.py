@@ -0,0 +1,105 @@
+"""
+OpenBNF response caching
+
+The formulary only changes when a loader runs, so a rendered page or
+API response is good until the next load. Every load stamps the
+dataset with a version (see store.dataset_version); responses are
+cached and tagged against that version, and the cache empties itself
+when it changes.
+"""
+import collections
+import hashlib
+import threading
+import time
+
+
+def one(value):
+    "SIZEOF for an LRUCache bounded by the number of its values"
+    return 1
+
+
+class LRUCache(object):
+    """
+    Least-recently-used cache bounded by the total size of its values
+    (as given by SIZEOF) rather than their number.
+
+    Pickles empty, so that it can be kept on objects we save.
+    """
+    def __init__(self, maxbytes, sizeof=len):
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return default
+            self.hits += 1
+            value, size = self.entries.pop(key)
+            self.entries[key] = (value, size)
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.maxbytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.maxbytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        state.update(entries=collections.OrderedDict(), bytes=0)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+class VersionedCache(LRUCache):
+    """
+    An LRUCache that is emptied whenever the dataset version reported
+    by FETCHVERSION changes. The version is looked up at most once
+    every TTL seconds, so most requests never touch the database.
+    """
+    def __init__(self, maxbytes, fetchversion, ttl=5, **kwargs):
+        super(VersionedCache, self).__init__(maxbytes, **kwargs)
+        self.fetchversion = fetchversion
+        self.ttl = ttl
+        self.checked = 0
+        self.current = None
+
+    def version(self):
+        "Return the current dataset version, clearing the cache if it moved on"
+        now = time.time()
+        if now - self.checked > self.ttl:
+            version = self.fetchversion()
+            self.checked = now
+            if version != self.current:
+                self.clear()
+                self.current = version
+        return self.current
+
+    def etag(self, key):
+        "Return the strong ETag for KEY in the current dataset version"
+        return hashlib.sha1(u'{0}:{1}'.format(self.version(), key).encode('utf-8')).hexdigest()
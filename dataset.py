@@ -0,0 +1,198 @@
+"""
+OpenBNF in-process dataset
+
+The web tier answers name searches, completions and suggestions (and,
+with settings.TEXT_SEARCH = 'memory', text searches) from indexes held
+in memory. They are built from one version of the stored dataset and
+replaced wholesale when a newer version is loaded.
+
+Each Dataset also records the store source (see store.current()) it
+was built from, and requests read their documents from that source,
+so indexes and documents always come from the same load.
+
+Building them means reading every drug from the store, so the loaders
+also write them to an artifact file (settings.INDEX_ARTIFACT) that a
+worker can unpickle instead. A worker that has to build the indexes
+itself writes the artifact too, so the next worker on the host doesn't.
+"""
+import copy
+import cPickle as pickle
+import functools
+import os
+import sys
+import threading
+import time
+import traceback
+
+import indexes
+import settings
+import store
+
+# Bump when the index classes change shape, to invalidate old artifacts
+ARTIFACT_FORMAT = 5
+
+
+class Dataset(object):
+    """
+    The in-process indexes for dataset VERSION, read from the store's
+    SOURCE. Never modified once built.
+
+    ITERDRUGS is called like store.iter_drugs to read the drugs to index;
+    by default it reads them from SOURCE.
+    """
+    def __init__(self, version, iterdrugs=None, source=None):
+        if iterdrugs is None:
+            iterdrugs = functools.partial(store.iter_drugs, source=source)
+        self.version = version
+        self.source = source
+        self.options = self.build_options()
+        self.name_index = indexes.NgramIndex.from_docs(iterdrugs([]), key='name')
+        self.names = self.name_index.names
+        self.autocomplete = indexes.Autocompleter(
+            self.name_index, ranking=settings.AUTOCOMPLETE_RANKING)
+        self.suggestions = indexes.SuggestionIndex(
+            self.names, max_candidates=settings.SUGGEST_CANDIDATES)
+        # Exact lookups by case-folded name and by BNF code
+        self.byname = dict((indexes.normalise(n), n) for n in self.names)
+        self.bycode = {}
+        drugs = list(iterdrugs(['codes', 'interactions']))
+        for drug in drugs:
+            for code in drug.get('codes', []):
+                self.bycode[code] = drug['name']
+        self.interactions = indexes.InteractionIndex.from_docs(drugs)
+        self.text_index = None
+        if settings.TEXT_SEARCH == 'memory':
+            self.text_index = indexes.TextIndex.from_docs(
+                iterdrugs(settings.TEXT_FIELDS), settings.TEXT_FIELDS, key='name')
+
+    @staticmethod
+    def build_options():
+        "The settings a Dataset is built with, which an artifact must match"
+        return (ARTIFACT_FORMAT, tuple(settings.AUTOCOMPLETE_RANKING),
+                settings.SUGGEST_CANDIDATES, settings.TEXT_SEARCH,
+                tuple(settings.TEXT_FIELDS))
+
+    def save(self, path):
+        "Atomically write this Dataset to the artifact file PATH"
+        tmp = '{0}.{1}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as fh:
+            pickle.dump(self, fh, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+
+    def at(self, source):
+        """
+        Return this Dataset reading from SOURCE, which holds the same
+        version (the same data loaded again).
+        """
+        dataset = copy.copy(self)
+        dataset.source = source
+        return dataset
+
+    @classmethod
+    def load(cls, path, version, source=None):
+        """
+        Return the Dataset in the artifact file PATH, reading from
+        SOURCE, if it was built from VERSION with our settings,
+        otherwise None.
+        """
+        try:
+            with open(path, 'rb') as fh:
+                dataset = pickle.load(fh)
+        except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+        if dataset.version != version or dataset.options != cls.build_options():
+            return None
+        # The same version holds the same drugs wherever it was read from
+        return dataset.at(source)
+
+
+def dataset_for(version, source=None):
+    """
+    Return the Dataset for VERSION, read from the store's SOURCE, from
+    the artifact if there is a current one, otherwise built from the
+    store and saved as the artifact.
+    """
+    path = settings.INDEX_ARTIFACT
+    dataset = Dataset.load(path, version, source) if path else None
+    if dataset is None:
+        dataset = Dataset(version, source=source)
+        if path:
+            try:
+                dataset.save(path)
+            except (IOError, OSError) as e:
+                print >> sys.stderr, 'Could not save index artifact:', e
+    return dataset
+
+
+def write_artifact(version, drugs=None, iterdrugs=None):
+    """
+    Build the Dataset for VERSION from the list of DRUGS a loader has
+    just stored, and save it as the artifact.
+
+    Loaders that stream drugs in pass ITERDRUGS, the iter_drugs of the
+    store they loaded, to read them back instead.
+    """
+    if settings.INDEX_ARTIFACT:
+        Dataset(version, iterdrugs or (lambda fields: drugs)).save(settings.INDEX_ARTIFACT)
+
+
+class LiveDataset(object):
+    """
+    Holds the current Dataset.
+
+    At most once every TTL seconds get() asks the store for the dataset
+    version. When it has moved on, the new Dataset is built on a
+    background thread while requests carry on with the old one, then
+    swapped in with a single assignment. Callers should get() the
+    Dataset once and use it throughout, reading documents from its
+    source, so they never mix versions.
+
+    With LAZY, nothing is loaded until the first get().
+    """
+    def __init__(self, ttl=5, lazy=False):
+        self.ttl = ttl
+        self.checked = time.time()
+        self.lock = threading.Lock()
+        self.builder = None
+        self.current = None
+        if not lazy:
+            self.current = dataset_for(*store.current())
+
+    def get(self):
+        "Return the current Dataset, starting a rebuild if it is out of date"
+        if self.current is None:
+            with self.lock:
+                if self.current is None:
+                    self.checked = time.time()
+                    self.current = dataset_for(*store.current())
+        elif time.time() - self.checked > self.ttl and self.lock.acquire(False):
+            try:
+                self.refresh()
+            finally:
+                self.lock.release()
+        return self.current
+
+    def refresh(self):
+        self.checked = time.time()
+        # Threads don't survive a fork, so a builder we inherited from
+        # the parent process reports itself dead and is replaced.
+        if self.builder is not None and self.builder.is_alive():
+            return
+        version, source = store.current()
+        if version == self.current.version:
+            if source != self.current.source:
+                # The same data loaded again: the old source may go away
+                self.current = self.current.at(source)
+        else:
+            self.builder = threading.Thread(target=self.rebuild, args=(version, source))
+            self.builder.daemon = True
+            self.builder.start()
+
+    def rebuild(self, version, source):
+        try:
+            dataset = dataset_for(version, source)
+        except Exception:
+            # Keep serving the old dataset; we try again after the next check.
+            traceback.print_exc(file=sys.stderr)
+            return
+        self.current = dataset
@@ -1,11 +1,29 @@
 """
 OpenBNF database access
+
+The client keeps a pool of up to settings.DB_POOL_SIZE sockets per
+process. Servers that fork workers should call reset() in each worker
+(see gunicorn.conf.py), so that no socket opened by the parent process
+is shared with its children.
 """
-from pymongo import Connection
+from pymongo import MongoClient
 
 import settings
 
-conn = Connection(host=settings.DB_HOST, port=settings.DB_PORT)
+def milliseconds(seconds):
+    return None if seconds is None else int(seconds * 1000)
+
+conn = MongoClient(host=settings.DB_HOST, port=settings.DB_PORT,
+                   max_pool_size=settings.DB_POOL_SIZE,
+                   connectTimeoutMS=milliseconds(settings.DB_CONNECT_TIMEOUT),
+                   socketTimeoutMS=milliseconds(settings.DB_SOCKET_TIMEOUT))
 db = getattr(conn, settings.DB)
 if settings.DB_USER and settings.DB_PASS:
     db.authenticate(settings.DB_USER, settings.DB_PASS)
+
+def reset():
+    """
+    Close every pooled socket. The pool reconnects, and authenticates,
+    on next use.
+    """
+    conn.disconnect()
@@ -0,0 +1,186 @@
+"""
+Export OpenBNF as a static site
+
+Render every drug page, the landing pages and the API documentation to
+a directory tree, each file with a precompressed .gz sibling, so that a
+web server or CDN can serve them without running any Python.
+
+Pages are written at their URL path plus an extension, e.g.
+
+    /                     -> index.html
+    /result/PARACETAMOL   -> result/PARACETAMOL.html
+    /result/A/B           -> result/A/B.html
+    /api/v2/openbnf/drug  -> api/v2/openbnf/drug.json
+
+A suitable nginx location is:
+
+    try_files $uri $uri.html $uri.json =404;
+    gzip_static on;
+
+Exports are incremental: a manifest of content hashes is kept in the
+output directory, and only drugs whose document changed since the last
+export are re-rendered (everything is, if the templates changed).
+
+Usage: python export.py OUTDIR [-p PROCESSES] [--host HOST] [--full]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import urllib
+
+import store
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = '.manifest.json'
+
+PAGES = [
+    '/',
+    '/about',
+    '/api/v2/doc',
+    '/api/v2/openbnf',
+    '/api/v2/openbnf/drug',
+    '/api/v2/openbnf/indication',
+    '/api/v2/openbnf/sideeffects',
+    '/api/v2/openbnf/sections',
+    '/api/v2/openbnf/interactions',
+    ]
+
+# Set in each worker by init_worker()
+client = None
+outdir = None
+host = None
+
+def drug_path(name):
+    "URL path of the page for the drug NAME"
+    return '/result/' + urllib.quote(name.encode('utf-8'), safe='')
+
+def output_file(directory, path, mimetype):
+    "Return the file under DIRECTORY we write the page at URL PATH to"
+    if path == '/':
+        path = '/index'
+    ext = '.json' if mimetype == 'application/json' else '.html'
+    fname = os.path.normpath(os.path.join(directory, urllib.unquote(path).lstrip('/') + ext))
+    if not fname.startswith(os.path.join(directory, '')):
+        raise ValueError('{0} is outside {1}'.format(path, directory))
+    return fname
+
+def write(fname, data):
+    """
+    Atomically write DATA to FNAME along with a gzipped FNAME.gz.
+    The gzip header carries no timestamp, so unchanged pages compress
+    to identical bytes.
+    """
+    dirname = os.path.dirname(fname)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:  # Another worker got there first
+            pass
+    with open(fname + '.tmp', 'wb') as fh:
+        fh.write(data)
+    os.rename(fname + '.tmp', fname)
+    with open(fname + '.gz.tmp', 'wb') as raw:
+        gz = gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0)
+        gz.write(data)
+        gz.close()
+    os.rename(fname + '.gz.tmp', fname + '.gz')
+
+def render(path):
+    """
+    Render the URL PATH through the application and write it out.
+    Returns (path, error message or None).
+    """
+    response = client.get(path, base_url='http://{0}'.format(host))
+    if response.status_code != 200:
+        return path, 'HTTP {0}'.format(response.status_code)
+    try:
+        fname = output_file(outdir, path, response.mimetype)
+    except ValueError as e:
+        return path, str(e)
+    write(fname, response.data)
+    return path, None
+
+def init_worker(directory, hostname):
+    global client, outdir, host
+    import app  # Deferred: importing app builds the search indexes
+    app.app.debug = False
+    client = app.app.test_client()
+    outdir = directory
+    host = hostname
+
+def templates_hash():
+    "Hash of everything under templates/, which every page depends on"
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(os.path.join(ROOT, 'templates'))):
+        for f in sorted(files):
+            digest.update(f)
+            digest.update(open(os.path.join(root, f), 'rb').read())
+    return digest.hexdigest()
+
+def drug_hashes():
+    "Return {name: content hash} for every drug in the database"
+    hashes = {}
+    for drug in store.iter_drugs():
+        hashes[drug['name']] = hashlib.sha1(json.dumps(drug, sort_keys=True)).hexdigest()
+    return hashes
+
+def main():
+    parser = argparse.ArgumentParser(description="Export OpenBNF as static files")
+    parser.add_argument('outdir', help='Directory to export to')
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(),
+                        help='Number of rendering processes')
+    parser.add_argument('--host', default='localhost',
+                        help='Host name the site will be served from (used in API docs)')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the manifest and render everything')
+    args = parser.parse_args()
+
+    directory = os.path.abspath(args.outdir)
+    manifest_file = os.path.join(directory, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_file) and not args.full:
+        manifest = json.loads(open(manifest_file).read())
+
+    templates = templates_hash()
+    hashes = drug_hashes()
+    previous = manifest.get('drugs', {})
+    if manifest.get('templates') != templates or manifest.get('host') != args.host:
+        previous = {}
+        paths = list(PAGES)
+    else:
+        paths = []
+    paths += [drug_path(n) for n, h in sorted(hashes.items()) if previous.get(n) != h]
+
+    for name in set(manifest.get('drugs', {})) - set(hashes):
+        fname = output_file(directory, drug_path(name), 'text/html')
+        for stale in (fname, fname + '.gz'):
+            if os.path.exists(stale):
+                os.remove(stale)
+
+    pool = multiprocessing.Pool(args.processes, init_worker, (directory, args.host))
+    failed = {}
+    for path, error in pool.imap_unordered(render, paths, chunksize=16):
+        if error:
+            failed[path] = error
+            sys.stderr.write('{0}: {1}\n'.format(path, error))
+    pool.close()
+    pool.join()
+
+    # Drugs that failed to render are left out, so the next run retries them.
+    rendered = dict((n, h) for n, h in hashes.items() if drug_path(n) not in failed)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(manifest_file, 'w') as fh:
+        fh.write(json.dumps({'templates': templates, 'host': args.host, 'drugs': rendered},
+                            indent=2, sort_keys=True))
+    drugpages = len([p for p in paths if p.startswith('/result/')])
+    print 'Rendered {0} pages ({1} failed), {2} drugs unchanged'.format(
+        len(paths) - len(failed), len(failed), len(hashes) - drugpages)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+OpenBNF fixtures
+
+The drug and BNF code fixtures that every loader starts from, and the
+load-time processing they share.
+
+Drugs come either from templates/bnf.json, a JSON object of drugs by
+name, or from a stream of drugs one per line as JSON, as written by
+`parser.py drugdict --ndjson`, which loaders can read without holding
+every drug in memory at once.
+"""
+import collections
+import hashlib
+import json
+import os
+
+BNF = os.path.join(os.path.dirname(__file__), 'templates/bnf.json')
+
+bnfcodesraw = open('data/bnfcodes.json', 'r').read()
+bnfcodes = json.loads(bnfcodesraw)
+
+def load():
+    "Return the list of drugs in templates/bnf.json, and the version they make"
+    with open(BNF, 'r') as fh:
+        bnfraw = fh.read()
+    return json.loads(bnfraw).values(), version(bnfraw)
+
+def version(bnfraw):
+    """
+    Return the version of the dataset the drug fixture BNFRAW makes.
+
+    The version is a hash of the fixtures, so reloading identical data
+    doesn't invalidate ETags that clients already hold.
+    """
+    return hashlib.sha1(bnfraw + bnfcodesraw).hexdigest()
+
+
+class NDJSONDrugs(object):
+    """
+    Iterate over the drugs in the file FH, one per line as JSON.
+
+    Once it has been iterated over, version() is the version of the
+    dataset they make: a hash, like version()'s, of the lines read.
+    """
+    def __init__(self, fh):
+        self.fh = fh
+        self.digest = hashlib.sha1()
+        self.count = 0
+
+    def __iter__(self):
+        for line in self.fh:
+            if not line.strip():
+                continue
+            self.digest.update(line)
+            self.count += 1
+            yield json.loads(line)
+
+    def version(self):
+        digest = self.digest.copy()
+        digest.update(bnfcodesraw)
+        return digest.hexdigest()
+
+
+def codekey(name):
+    return name.strip().upper()
+
+def join_codes(drugs, codemaps):
+    """
+    Embed the BNF codes from CODEMAPS on the DRUGS they name, as a
+    `codes` list, so that looking a drug up by code is a single read.
+
+    Names are matched ignoring case and surrounding whitespace.
+    Return a coverage report: the number of codes that resolved, and
+    the code maps that didn't (either no drug has that name, or the
+    code was already claimed by another name).
+    """
+    byname = dict((codekey(d['name']), d) for d in drugs)
+    for drug in drugs:
+        drug.pop('codes', None)
+    claimed = set()
+    unmatched = []
+    for codemap in codemaps:
+        drug = byname.get(codekey(codemap['name']))
+        if drug is None or codemap['code'] in claimed:
+            unmatched.append(codemap)
+            continue
+        claimed.add(codemap['code'])
+        drug.setdefault('codes', []).append(codemap['code'])
+    return {
+        'codes': len(codemaps),
+        'matched': len(claimed),
+        'drugs': len([d for d in drugs if 'codes' in d]),
+        'total': len(drugs),
+        'unmatched': unmatched,
+        }
+
+
+class CodeJoiner(object):
+    """
+    join_codes for a stream of drugs: join(drug) embeds the codes from
+    CODEMAPS on each drug as it goes by, and report() is join_codes'
+    coverage report once they all have.
+
+    Where two drugs have the same name, the codes go to the first
+    rather than, as with join_codes, the last.
+    """
+    def __init__(self, codemaps):
+        self.codemaps = codemaps
+        self.byname = collections.defaultdict(list)
+        for i, codemap in enumerate(codemaps):
+            self.byname[codekey(codemap['name'])].append(i)
+        self.claimed = set()
+        self.matched = set()
+        self.drugs = 0
+        self.total = 0
+
+    def join(self, drug):
+        drug.pop('codes', None)
+        for i in self.byname.get(codekey(drug['name']), []):
+            code = self.codemaps[i]['code']
+            if code in self.claimed:
+                continue
+            self.claimed.add(code)
+            self.matched.add(i)
+            drug.setdefault('codes', []).append(code)
+        self.total += 1
+        if 'codes' in drug:
+            self.drugs += 1
+        return drug
+
+    def report(self):
+        return {
+            'codes': len(self.codemaps),
+            'matched': len(self.claimed),
+            'drugs': self.drugs,
+            'total': self.total,
+            'unmatched': [c for i, c in enumerate(self.codemaps) if i not in self.matched],
+            }
+
+
+def print_coverage(report):
+    "Print the join coverage REPORT from join_codes"
+    for codemap in sorted(report['unmatched'], key=lambda c: c['code']):
+        print u'No drug for {0} {1}'.format(codemap['code'], codemap['name']).encode('utf-8')
+    print '{0} of {1} BNF codes resolved to a drug ({2:.1f}%), {3} of {4} drugs have a code'.format(
+        report['matched'], report['codes'],
+        100.0 * report['matched'] / max(report['codes'], 1),
+        report['drugs'], report['total'])
@@ -0,0 +1,58 @@
+"""
+Gunicorn configuration for serving OpenBNF in production
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+The application is imported once, in the master process, before the
+workers fork. Every worker then shares the master's copy of the
+in-process indexes rather than building its own. Each worker drops any
+database sockets it inherited and opens its own pooled connections.
+
+Workers write their metrics to settings.METRICS_DIR (a temporary
+directory unless OPENBNF_METRICS_DIR is set) so that /metrics, whichever
+worker answers it, reports them all. It is emptied when we start.
+
+On SIGTERM (what Heroku sends), workers stop accepting new connections
+and have settings.WEB_GRACEFUL_TIMEOUT seconds to finish the requests
+in flight before they are killed. This needs gunicorn 19 or later:
+before that, TERM stopped them at once. SIGQUIT and SIGINT still do.
+"""
+import glob
+import os
+import shutil
+import tempfile
+
+import settings
+
+# Set before the app is preloaded, so that every worker inherits it
+made_metrics_dir = not settings.METRICS_DIR
+if made_metrics_dir:
+    settings.METRICS_DIR = tempfile.mkdtemp(prefix='openbnf-metrics-')
+
+bind = '0.0.0.0:{0}'.format(os.environ.get('PORT', 5000))
+workers = settings.WEB_WORKERS
+worker_class = settings.WEB_WORKER_CLASS
+timeout = settings.WEB_TIMEOUT
+graceful_timeout = settings.WEB_GRACEFUL_TIMEOUT
+preload_app = True
+accesslog = '-'
+
+def on_starting(server):
+    for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+        os.remove(path)
+
+def on_exit(server):
+    if made_metrics_dir:
+        shutil.rmtree(settings.METRICS_DIR, ignore_errors=True)
+
+def post_fork(server, worker):
+    if settings.STORE_BACKEND == 'mongo':
+        import db
+        db.reset()
+
+def worker_exit(server, worker):
+    import metrics
+    metrics.flush()
+    if settings.STORE_BACKEND == 'mongo':
+        import db
+        db.reset()
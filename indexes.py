@@ -0,0 +1,489 @@
+"""
+OpenBNF in-process search indexes
+
+Drug names are small and change only when we reload the formulary, so
+rather than asking Mongo to run an unanchored regex over every document
+we keep an n-gram index of the names in memory and resolve substring
+lookups to document keys ourselves. The long free-text sections get a
+ranked inverted index for the same reason.
+"""
+import bisect
+import collections
+import difflib
+import heapq
+import math
+import re
+
+import cache
+
+
+def normalise(text):
+    "Case-fold TEXT for index lookups"
+    return unicode(text).lower()
+
+
+class NgramIndex(object):
+    """
+    Substring index over a collection of short strings (drug names).
+
+    Every name is broken into all of its grams of length 1..N. A query
+    of length <= N is answered directly from its postings list; longer
+    queries intersect the postings of their N-grams (smallest first) to
+    get a small candidate set, which is then verified with a plain
+    substring test. Cost is bounded by the rarest gram in the query,
+    not by the number of names we hold.
+    """
+    def __init__(self, n=3):
+        self.n = n
+        self.keys = []   # Document key per slot
+        self.names = []  # Original text per slot
+        self.texts = []  # Normalised text per slot
+        self.postings = collections.defaultdict(set)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def grams(self, text):
+        "Return the set of distinct grams of length 1..N in TEXT"
+        grams = set()
+        for size in range(1, self.n + 1):
+            for i in xrange(len(text) - size + 1):
+                grams.add(text[i:i + size])
+        return grams
+
+    def add(self, key, text):
+        """
+        Index TEXT, such that lookups which match it will return KEY.
+        """
+        slot = len(self.keys)
+        self.keys.append(key)
+        self.names.append(text)
+        text = normalise(text)
+        self.texts.append(text)
+        for gram in self.grams(text):
+            self.postings[gram].add(slot)
+        return slot
+
+    def slots(self, term):
+        """
+        Return the set of slots whose text contains TERM, ignoring case.
+        """
+        term = normalise(term)
+        if not term:
+            return set(range(len(self.keys)))
+        if len(term) <= self.n:
+            return set(self.postings.get(term, ()))
+
+        grams = set(term[i:i + self.n] for i in xrange(len(term) - self.n + 1))
+        postings = sorted((self.postings.get(g, set()) for g in grams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if not candidates:
+                break
+            candidates &= posting
+        return set(s for s in candidates if term in self.texts[s])
+
+    def search(self, term):
+        """
+        Return the keys of every entry containing TERM, in index order.
+        """
+        return [self.keys[s] for s in sorted(self.slots(term))]
+
+    @classmethod
+    def from_docs(klass, docs, key='_id', field='name', **kwargs):
+        """
+        Build an index from an iterable of documents, indexing FIELD
+        under KEY.
+        """
+        index = klass(**kwargs)
+        for doc in docs:
+            if doc.get(field):
+                index.add(doc[key], doc[field])
+        return index
+
+
+class SuggestionIndex(object):
+    """
+    "Did you mean" index over drug names.
+
+    Scores candidates with the same SequenceMatcher ratio that
+    difflib.get_close_matches uses, but only for the handful of names
+    that share trigrams with the query. Names are first filtered on the
+    upper bound that their lengths place on the ratio, then ranked by
+    the number of padded trigrams they share with the query, and only
+    the best MAX_CANDIDATES of those are scored exactly. Names that share
+    no trigram with the query are never suggested, which is where most
+    of the remaining differences from get_close_matches come from (see
+    bench/suggest.py).
+
+    Mistyped queries tend to arrive in bursts (every keystroke of an
+    autocomplete that has stopped matching), so the last MEMO_SIZE
+    answers are remembered, in an LRUCache that threads can share.
+    """
+    def __init__(self, names=(), max_candidates=200, memo_size=1024):
+        self.max_candidates = max_candidates
+        self.memo = cache.LRUCache(memo_size, sizeof=cache.one)
+        self.names = []
+        self.texts = []
+        self.postings = collections.defaultdict(list)
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def grams(text):
+        "Return the set of trigrams in TEXT, padded so short words still have some"
+        padded = u' {0} '.format(text)
+        return set(padded[i:i + 3] for i in xrange(len(padded) - 2))
+
+    def add(self, name):
+        slot = len(self.names)
+        text = normalise(name)
+        self.names.append(name)
+        self.texts.append(text)
+        for gram in self.grams(text):
+            self.postings[gram].append(slot)
+        self.memo.clear()
+        return slot
+
+    def suggest(self, term, n=3, cutoff=0.6):
+        """
+        Return up to N names whose similarity ratio with TERM is at
+        least CUTOFF, best first.
+        """
+        term = normalise(term).strip()
+        if not term:
+            return []
+        memokey = (term, n, cutoff)
+        hit = self.memo.get(memokey)
+        if hit is not None:
+            return list(hit)
+
+        size = len(term)
+        # ratio = 2M / (a + b) and M <= min(a, b)
+        lengthok = lambda l: 2.0 * min(l, size) / (l + size) >= cutoff
+
+        overlap = collections.defaultdict(int)
+        for gram in self.grams(term):
+            for slot in self.postings.get(gram, ()):
+                overlap[slot] += 1
+        candidates = [s for s in overlap if lengthok(len(self.texts[s]))]
+        candidates = heapq.nlargest(self.max_candidates, candidates,
+                                    key=lambda s: (overlap[s], -s))
+
+        # quick_ratio() is a cheap upper bound on ratio(). Score the
+        # candidates in descending order of that bound, and stop as soon
+        # as the bound falls below the worst of the N results we hold.
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(term)
+        bounded = []
+        for slot in candidates:
+            matcher.set_seq1(self.texts[slot])
+            bound = matcher.quick_ratio()
+            if bound >= cutoff:
+                bounded.append((bound, slot))
+        bounded.sort(reverse=True)
+
+        best = []
+        for bound, slot in bounded:
+            bar = best[0][0] if len(best) == n else cutoff
+            if bound < bar:
+                break
+            matcher.set_seq1(self.texts[slot])
+            ratio = matcher.ratio()
+            if ratio >= bar:
+                # Ties go the way get_close_matches breaks them
+                scored = (ratio, self.texts[slot], self.names[slot])
+                if len(best) < n:
+                    heapq.heappush(best, scored)
+                else:
+                    heapq.heappushpop(best, scored)
+        best.sort(reverse=True)
+        suggestions = tuple(name for ratio, text, name in best)
+        self.memo.set(memokey, suggestions)
+        return list(suggestions)
+
+
+class Autocompleter(object):
+    """
+    Top-K name completion over an NgramIndex.
+
+    Keeps the normalised names in a sorted array so that prefix matches
+    are a bisect away, and falls back to the n-gram index for infix
+    matches. RANKING is a sequence of the criteria in RANKERS, applied
+    in order: by default prefix matches beat infix matches, then
+    shorter names beat longer ones, then alphabetical order.
+    """
+    RANKERS = {
+        'prefix': lambda text, term: not text.startswith(term),
+        'length': lambda text, term: len(text),
+        'name': lambda text, term: text,
+        }
+
+    def __init__(self, ngrams, ranking=('prefix', 'length', 'name'),
+                 memo_size=1024):
+        # Kept by name rather than function, so that we can be pickled
+        for r in ranking:
+            if r not in self.RANKERS:
+                raise ValueError('Unknown ranking {0}'.format(r))
+        self.ngrams = ngrams
+        self.ranking = tuple(ranking)
+        self.memo = cache.LRUCache(memo_size, sizeof=cache.one)
+        self.sorted = sorted((t, s) for s, t in enumerate(ngrams.texts))
+
+    def prefixed(self, term):
+        "Return the slots whose normalised text starts with TERM"
+        lo = bisect.bisect_left(self.sorted, (term,))
+        hi = bisect.bisect_left(self.sorted, (term + u'\U0010ffff',))
+        return [s for t, s in self.sorted[lo:hi]]
+
+    def complete(self, term, limit=10):
+        """
+        Return up to LIMIT names matching TERM, best first.
+        """
+        term = normalise(term)
+        memokey = (term, limit)
+        hit = self.memo.get(memokey)
+        if hit is not None:
+            return list(hit)
+
+        texts = self.ngrams.texts
+        rankers = [self.RANKERS[r] for r in self.ranking]
+        key = lambda s: tuple(r(texts[s], term) for r in rankers) + (s,)
+        candidates = self.prefixed(term)
+        # When prefix matches outrank everything else and there are
+        # enough of them, there is no need to look at infix matches.
+        if not (self.ranking and self.ranking[0] == 'prefix'
+                and len(candidates) >= limit):
+            candidates = self.ngrams.slots(term)
+        names = tuple(self.ngrams.names[s] for s in heapq.nsmallest(limit, candidates, key=key))
+        self.memo.set(memokey, names)
+        return list(names)
+
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+_clause_re = re.compile(r'"([^"]*)"?|(\S+)')
+
+def words(text):
+    "Split TEXT into normalised words"
+    return _word_re.findall(normalise(text))
+
+def text_clauses(query):
+    """
+    Split a text search QUERY into clauses, each a list of words: a
+    single word, a single word prefix ending in '*', or the words of a
+    "quoted phrase".
+    """
+    clauses = []
+    for phrase, word in _clause_re.findall(query):
+        if word.endswith('*') and len(word) > 1:
+            stem = words(word[:-1])
+            clauses.extend([[w] for w in stem[:-1]])
+            if stem:
+                clauses.append([stem[-1] + u'*'])
+            continue
+        tokens = words(phrase or word)
+        if phrase:
+            clauses.append(tokens)
+        else:
+            clauses.extend([[w] for w in tokens])
+    return [c for c in clauses if c]
+
+
+class TextIndex(object):
+    """
+    Positional inverted index over the free-text sections of drugs
+    (indications, side-effects, ...), ranked with BM25.
+
+    A query is a list of clauses, all of which must match:
+    a word, a word prefix ending in '*', or a "quoted phrase".
+    """
+    def __init__(self, fields, k1=1.2, b=0.75):
+        self.fields = list(fields)
+        self.k1 = k1
+        self.b = b
+        self.keys = []
+        # field -> word -> {slot: [positions]}
+        self.postings = dict((f, {}) for f in self.fields)
+        # field -> slot -> number of words
+        self.lengths = dict((f, {}) for f in self.fields)
+        self.totals = dict((f, 0) for f in self.fields)
+        self.vocabularies = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, doc):
+        """
+        Index the text FIELDS of DOC under KEY.
+        """
+        slot = len(self.keys)
+        self.keys.append(key)
+        for field in self.fields:
+            if not doc.get(field):
+                continue
+            tokens = words(doc[field])
+            self.lengths[field][slot] = len(tokens)
+            self.totals[field] += len(tokens)
+            postings = self.postings[field]
+            for position, word in enumerate(tokens):
+                postings.setdefault(word, {}).setdefault(slot, []).append(position)
+        self.vocabularies.clear()
+        return slot
+
+    def vocabulary(self, field):
+        "Sorted list of the words in FIELD, for prefix queries"
+        if field not in self.vocabularies:
+            self.vocabularies[field] = sorted(self.postings[field])
+        return self.vocabularies[field]
+
+    def clauses(self, query):
+        "Return QUERY as a list of clauses, each a list of words"
+        return text_clauses(query)
+
+    def frequencies(self, clause, field):
+        """
+        Return {slot: occurrences} of CLAUSE in FIELD.
+        """
+        postings = self.postings[field]
+        if len(clause) == 1:
+            word = clause[0]
+            if word.endswith(u'*'):
+                stem = word[:-1]
+                vocab = self.vocabulary(field)
+                tf = collections.defaultdict(int)
+                for i in xrange(bisect.bisect_left(vocab, stem), len(vocab)):
+                    if not vocab[i].startswith(stem):
+                        break
+                    for slot, positions in postings[vocab[i]].iteritems():
+                        tf[slot] += len(positions)
+                return tf
+            return dict((s, len(p)) for s, p in postings.get(word, {}).iteritems())
+
+        # Phrase: every word at consecutive positions
+        lists = [postings.get(w, {}) for w in clause]
+        slots = set(min(lists, key=len))
+        for posting in lists:
+            slots &= set(posting)
+        tf = {}
+        for slot in slots:
+            starts = set(lists[0][slot])
+            for offset, posting in enumerate(lists[1:], 1):
+                starts &= set(p - offset for p in posting[slot])
+            if starts:
+                tf[slot] = len(starts)
+        return tf
+
+    def search(self, query, fields=None):
+        """
+        Return [(key, score)] for the entries matching every clause of
+        QUERY in any of FIELDS, best first.
+        """
+        fields = fields or self.fields
+        clauses = self.clauses(query)
+        if not clauses:
+            return []
+
+        scores = None
+        for clause in clauses:
+            clausescores = collections.defaultdict(float)
+            for field in fields:
+                tf = self.frequencies(clause, field)
+                if not tf:
+                    continue
+                ndocs = len(self.lengths[field])
+                avglen = float(self.totals[field]) / ndocs
+                idf = math.log(1 + (ndocs - len(tf) + 0.5) / (len(tf) + 0.5))
+                for slot, freq in tf.iteritems():
+                    norm = 1 - self.b + self.b * self.lengths[field][slot] / avglen
+                    clausescores[slot] += idf * freq * (self.k1 + 1) / (freq + self.k1 * norm)
+            if scores is None:
+                scores = clausescores
+            else:
+                scores = dict((s, scores[s] + v) for s, v in clausescores.iteritems()
+                              if s in scores)
+            if not scores:
+                return []
+
+        ranked = sorted(scores.iteritems(), key=lambda x: (-x[1], x[0]))
+        return [(self.keys[s], score) for s, score in ranked]
+
+    @classmethod
+    def from_docs(klass, docs, fields, key='_id', **kwargs):
+        "Build an index of FIELDS from an iterable of documents"
+        index = klass(fields, **kwargs)
+        for doc in docs:
+            index.add(doc[key], doc)
+        return index
+
+
+class InteractionIndex(object):
+    """
+    Which drugs interact, as an adjacency map, so that checking a list
+    of N drugs costs N^2 dictionary lookups however big the formulary.
+
+    A drug's `interactions` document holds its interaction text, the
+    severity of the interaction (`bad`), and the `mentions`: the drugs
+    its interaction text names (see parser.make_xrefs). Each is an
+    interacting pair, described by that text, whether or not the other
+    drug has an interactions table of its own.
+
+    DOCUMENTED is the number of drugs that had one: with none, the
+    index knows nothing, rather than that no drugs interact.
+    """
+    def __init__(self):
+        # name -> {other name: {'severity': n, 'interaction': [texts]}}
+        self.adjacent = {}
+        self.documented = 0
+
+    def add(self, a, b, severity, text):
+        "Record that A and B interact, as TEXT says, with SEVERITY"
+        pair = self.adjacent.setdefault(a, {}).get(b)
+        if pair is None:
+            pair = {'severity': severity, 'interaction': []}
+            self.adjacent[a][b] = self.adjacent.setdefault(b, {})[a] = pair
+        pair['severity'] = max(pair['severity'], severity)
+        if text and text not in pair['interaction']:
+            pair['interaction'].append(text)
+
+    def pairs(self, names):
+        """
+        Return [(a, b, {'severity', 'interaction'})] for every
+        interacting pair among NAMES, in the order given.
+        """
+        found = []
+        for i, a in enumerate(names):
+            adjacent = self.adjacent.get(a)
+            if not adjacent:
+                continue
+            for b in names[i + 1:]:
+                if b in adjacent:
+                    found.append((a, b, adjacent[b]))
+        return found
+
+    @classmethod
+    def from_docs(klass, docs, key='name', field='interactions'):
+        "Build an index from the interactions of an iterable of documents"
+        index = klass()
+        described = {}
+        backrefs = []
+        for doc in docs:
+            interactions = doc.get(field)
+            if not isinstance(interactions, dict):
+                continue
+            index.documented += 1
+            severity = interactions.get('bad', 0) or 0
+            text = interactions.get('interaction', u'')
+            described[doc[key]] = (severity, text)
+            for other in interactions.get('mentions', []):
+                if other != doc[key]:
+                    index.add(doc[key], other, severity, text)
+            backrefs += [(other, doc[key]) for other in interactions.get('backrefs', [])]
+        # Drugs cross referenced before `mentions` was recorded
+        for name, other in backrefs:
+            if name != other and name in described:
+                severity, text = described[name]
+                index.add(name, other, severity, text)
+        return index
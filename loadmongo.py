@@ -1,32 +1,62 @@
 """
 Load fixtures into MongoDB
+
+Usage: python loadmongo.py [--ndjson FILE]
+
+With --ndjson the drugs are read from FILE (- for stdin), one per line
+as JSON, rather than from templates/bnf.json, and are written as they
+are read, so the parser can be piped straight in:
+
+    python parser.py drugdict --ndjson | python loadmongo.py --ndjson -
 """
-import json
-import os
+import argparse
+import datetime
+import itertools
 import sys
+import time
 
 from db import db
+from fixtures import bnfcodes, join_codes, print_coverage
+import dataset
+import fixtures
+import store
 
-bnf =  json.loads(
-    open(os.path.join(
-            os.path.dirname(__file__),
-            'templates/bnf.json'
-        ), 'r').read()
-    )
+def main():
+    """
+    Load the fixtures as a new generation of the drugs collection and
+    switch the dataset over to it. The web tier picks the new
+    generation up without a restart.
 
-bnfcodes = json.loads(
-    open('data/bnfcodes.json', 'r').read()
-    )
+    Batch size and the number of parallel writers are
+    settings.LOAD_BATCH_SIZE and LOAD_WRITERS.
+    """
+    parser = argparse.ArgumentParser(description="Load fixtures into MongoDB")
+    parser.add_argument('--ndjson', type=str,
+                        help='File (- for stdin) of drugs, one per line as JSON')
+    args = parser.parse_args()
 
-def main():
-    db.drugs.drop()
-    db.codes.drop()
-    for drug in bnf.values():
-        db.drugs.save(drug)
-    for codemap in bnfcodes:
-        db.codes.save(codemap)
+    mongo = store.MongoStore(db)
+    loaded = datetime.datetime.utcnow()
+    start = time.time()
+    if args.ndjson:
+        drugs = fixtures.NDJSONDrugs(sys.stdin if args.ndjson == '-' else open(args.ndjson, 'r'))
+        joiner = fixtures.CodeJoiner(bnfcodes)
+        generation = mongo.load(itertools.imap(joiner.join, drugs), drugs.version, loaded=loaded)
+        elapsed = time.time() - start
+        # Read back rather than held on to while loading
+        dataset.write_artifact(drugs.version(), iterdrugs=mongo.at(generation).iter_drugs)
+        count, report = drugs.count, joiner.report()
+    else:
+        drugs, version = fixtures.load()
+        report = join_codes(drugs, bnfcodes)
+        generation = mongo.load(drugs, version, loaded=loaded)
+        elapsed = time.time() - start
+        dataset.write_artifact(version, drugs)
+        count = len(drugs)
+    print 'Loaded {0} drugs into {1} in {2:.1f}s ({3:.0f} drugs/s)'.format(
+        count, generation, elapsed, count / max(elapsed, 1e-6))
+    print_coverage(report)
     return 0
 
 if __name__ == '__main__':
-    db.drugs.drop()
     sys.exit(main())
@@ -0,0 +1,25 @@
+"""
+Build the memory-mapped snapshot from the fixtures
+
+Usage: python loadsnapshot.py [PATH]
+
+PATH defaults to settings.SNAPSHOT_PATH.
+"""
+import sys
+
+from fixtures import bnfcodes, join_codes, print_coverage
+import dataset
+import fixtures
+import settings
+import snapshot
+
+def main(path=settings.SNAPSHOT_PATH):
+    drugs, version = fixtures.load()
+    report = join_codes(drugs, bnfcodes)
+    snapshot.build(path, drugs, version)
+    dataset.write_artifact(version, drugs)
+    print_coverage(report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
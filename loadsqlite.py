@@ -0,0 +1,25 @@
+"""
+Build the embedded SQLite store from the fixtures
+
+Usage: python loadsqlite.py [PATH]
+
+PATH defaults to settings.SQLITE_PATH.
+"""
+import sys
+
+from fixtures import bnfcodes, join_codes, print_coverage
+import dataset
+import fixtures
+import settings
+import sqlitestore
+
+def main(path=settings.SQLITE_PATH):
+    drugs, version = fixtures.load()
+    report = join_codes(drugs, bnfcodes)
+    sqlitestore.build(path, drugs, version, settings.TEXT_FIELDS)
+    dataset.write_artifact(version, drugs)
+    print_coverage(report)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(*sys.argv[1:]))
@@ -0,0 +1,278 @@
+"""
+OpenBNF metrics
+
+In-process counters and histograms, served by app.py at /metrics in the
+Prometheus text format, plus a sampled log of requests.
+
+Each web worker keeps its own metrics, but a scrape is answered by
+whichever worker picks it up. So with settings.METRICS_DIR set (as
+gunicorn.conf.py does), every worker writes its samples to a file of
+its own there each settings.METRICS_FLUSH seconds, and again as it
+exits. /metrics adds up every file, so it reports the totals for all
+the workers on the host. The files of workers that have gone are kept,
+so counts never go backwards when one is replaced.
+
+Recording a sample is a dict lookup and a few additions under a lock, so
+this is cheap enough to leave on.
+"""
+import bisect
+import collections
+import contextlib
+import glob
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+
+import settings
+
+# Seconds
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+REGISTRY = []
+
+log = logging.getLogger('openbnf.requests')
+
+
+def escape(value):
+    return unicode(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return u'{{{0}}}'.format(u','.join(u'{0}="{1}"'.format(k, escape(v)) for k, v in pairs))
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Metric(object):
+    """
+    A named family of time series, one for each combination of values
+    of LABELS.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.series = {}
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(labels[l] for l in self.labels)
+
+    def samples(self):
+        "Yield (suffix, [(label, value)], value) for every sample"
+        with self.lock:
+            series = sorted(self.series.items())
+        for key, value in series:
+            yield '', zip(self.labels, key), value
+
+    def render(self, samples=None):
+        "Return the lines for SAMPLES, by default this process's samples()"
+        lines = [u'# HELP {0} {1}'.format(self.name, self.help),
+                 u'# TYPE {0} {1}'.format(self.name, self.kind)]
+        for suffix, labels, value in (self.samples() if samples is None else samples):
+            lines.append(u'{0}{1}{2} {3}'.format(
+                self.name, suffix, format_labels(labels), format_value(value)))
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts (the last for values beyond every
+                # bucket), sum, count
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self.lock:
+            series = sorted((k, ([c for c in v[0]], v[1], v[2])) for k, v in self.series.items())
+        for key, (counts, total, count) in series:
+            labels = zip(self.labels, key)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                yield '_bucket', labels + [('le', format_value(bound))], cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+
+class Collected(Metric):
+    """
+    A metric whose samples are read when we are scraped: COLLECT
+    returns a list of ({label: value}, value).
+    """
+    def __init__(self, name, help, kind, labels, collect):
+        super(Collected, self).__init__(name, help, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in self.collect():
+            yield '', [(l, labels[l]) for l in self.labels], value
+
+
+REQUEST_SECONDS = Histogram(
+    'openbnf_request_seconds', 'Time to handle a request, by endpoint',
+    ('endpoint', 'method', 'status'))
+REQUEST_QUERIES = Histogram(
+    'openbnf_request_store_queries', 'Storage backend queries made per request',
+    ('endpoint',), buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100))
+REQUEST_QUERY_SECONDS = Histogram(
+    'openbnf_request_store_seconds', 'Time per request spent in the storage backend',
+    ('endpoint',))
+STORE_SECONDS = Histogram(
+    'openbnf_store_query_seconds', 'Storage backend query time, by query', ('query',))
+RENDER_SECONDS = Histogram(
+    'openbnf_template_render_seconds', 'Template rendering time, by template', ('template',))
+SUGGEST_SECONDS = Histogram(
+    'openbnf_suggest_seconds', 'Time to find "did you mean" suggestions for a search')
+
+
+_local = threading.local()
+
+def start_request():
+    watch()
+    _local.request = {'start': time.time(), 'queries': 0, 'query_seconds': 0.0, 'fields': {}}
+
+def annotate(**fields):
+    "Add FIELDS to the log record of the current request"
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current['fields'].update(fields)
+
+def finish_request(endpoint, method, path, status):
+    """
+    Record the request started by start_request(), and log it if it is
+    sampled (settings.REQUEST_LOG_SAMPLE) or slow (REQUEST_LOG_SLOW).
+    """
+    current = getattr(_local, 'request', None)
+    if current is None:
+        return
+    _local.request = None
+    elapsed = time.time() - current['start']
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=method, status=status)
+    REQUEST_QUERIES.observe(current['queries'], endpoint=endpoint)
+    REQUEST_QUERY_SECONDS.observe(current['query_seconds'], endpoint=endpoint)
+    if elapsed >= settings.REQUEST_LOG_SLOW or random.random() < settings.REQUEST_LOG_SAMPLE:
+        record = dict(current['fields'], endpoint=endpoint, method=method, path=path,
+                      status=status, ms=round(elapsed * 1000, 1), queries=current['queries'],
+                      query_ms=round(current['query_seconds'] * 1000, 1))
+        log.info(json.dumps(record, sort_keys=True))
+
+def record_query(query, seconds):
+    STORE_SECONDS.observe(seconds, query=query)
+    current = getattr(_local, 'request', None)
+    if current is not None:
+        current['queries'] += 1
+        current['query_seconds'] += seconds
+
+@contextlib.contextmanager
+def timed(histogram, **labels):
+    "Observe the time the body of the with statement takes in HISTOGRAM"
+    start = time.time()
+    try:
+        yield
+    finally:
+        histogram.observe(time.time() - start, **labels)
+
+def local_samples():
+    "Return [name, suffix, [[label, value]], value] for every sample in this process"
+    return [[metric.name, suffix, labels, value]
+            for metric in REGISTRY
+            for suffix, labels, value in metric.samples()]
+
+def flush():
+    "Write this process's samples to its file in settings.METRICS_DIR"
+    if not settings.METRICS_DIR:
+        return
+    path = os.path.join(settings.METRICS_DIR, '{0}.json'.format(os.getpid()))
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as fh:
+        json.dump(local_samples(), fh)
+    os.rename(tmp, path)
+
+_flusher = {'pid': None}
+_flusher_lock = threading.Lock()
+
+def watch():
+    """
+    Start flushing this process's samples every settings.METRICS_FLUSH
+    seconds, if there is a METRICS_DIR and we aren't already. Threads
+    don't survive a fork, so each worker starts its own.
+    """
+    if not settings.METRICS_DIR or _flusher['pid'] == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher['pid'] == os.getpid():
+            return
+        _flusher['pid'] = os.getpid()
+        thread = threading.Thread(target=flush_forever)
+        thread.daemon = True
+        thread.start()
+
+def flush_forever():
+    while True:
+        time.sleep(settings.METRICS_FLUSH)
+        try:
+            flush()
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+
+def merged():
+    """
+    Return {(name, suffix, labels): value}, adding up the samples of
+    every process that has written to settings.METRICS_DIR.
+    """
+    flush()
+    totals = collections.OrderedDict()
+    for path in sorted(glob.glob(os.path.join(settings.METRICS_DIR, '*.json'))):
+        try:
+            with open(path, 'r') as fh:
+                samples = json.load(fh)
+        except (IOError, ValueError):
+            continue
+        for name, suffix, labels, value in samples:
+            key = (name, suffix, tuple(tuple(l) for l in labels))
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+def render():
+    """
+    Return every metric in the Prometheus text exposition format: for
+    all the processes writing to settings.METRICS_DIR if it is set,
+    otherwise for this one.
+    """
+    totals = merged() if settings.METRICS_DIR else None
+    lines = []
+    for metric in REGISTRY:
+        samples = None
+        if totals is not None:
+            samples = [(suffix, list(labels), value)
+                       for (name, suffix, labels), value in totals.items()
+                       if name == metric.name]
+        lines.extend(metric.render(samples))
+    return u'\n'.join(lines) + u'\n'
@@ -16,8 +16,14 @@ that we wish to work on.
 
 Thus via simple *nix piping, we can drastically reduce time spent on pointless
 I/o per run.
+
+drugdict -c CACHE goes further, keeping the results of parsing each file
+between runs, so that a new snapshot only costs the pages that changed.
 """
 import collections
+import contextlib
+import hashlib
+import itertools
 import json
 import logging
 import multiprocessing
@@ -64,13 +70,20 @@ _paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
 def ld(fname):
     return json.loads(open(fname).read().strip())
 
-def chunks(l, n):
-    """
-    A generator function for chopping up a given list into chunks of
-    length n.
-    """
-    for i in xrange(0, len(l), n):
-        yield l[i:i+n]
+def read_ndjson(fh):
+    "Read a dict of drugs by name from FH, one drug per line as JSON"
+    drugs = {}
+    for line in fh:
+        if line.strip():
+            drug = json.loads(line)
+            drugs[drug['name']] = drug
+    return drugs
+
+def write_ndjson(drugs, fh):
+    "Write the dict of DRUGS to FH, one per line as JSON, in name order"
+    for name in sorted(drugs):
+        fh.write(json.dumps(drugs[name]))
+        fh.write('\n')
 
 def pp(d):
     "JSON Pretty Print a dict"
@@ -351,41 +364,52 @@ def merge_entries(new, drugs):
 
 
 
-# def fextract(x):
-#         print x
-#         return _extract_drugs(filelist=x)
-
-
-def extract_drugs(args, filelist=None):
+@contextlib.contextmanager
+def mapper(args):
     """
-    Top-level drug extraction entrypoint.
-
     Examine the args and decide whether to map-reduce.
 
-    If so, set up the infrastructure and then delegate to _extract_drugs.
+    Yield a function with the signature of itertools.imap: either that,
+    or one that runs in a pool of processes, handing results back in
+    order however the work is shared out.
     """
     if args.processes == 1: # Don't bother
-        return _extract_drugs(filelist=filelist)
-    if args.processes !=- 1:
+        yield itertools.imap
+        return
+    if args.processes != -1:
         nprocs = args.processes
     else:
-        nprocs = workers = multiprocessing.cpu_count() * 2 + 1
-
-    def merge_dicts(*dicts):
-        """
-        Merge a sequence of Drug dicts
-        """
-        return dicts
-
-    pool = multiprocessing.Pool(processes=4)
-    filez = filelist or list(bnfhtml())
-    if MAXDRUGS:
-        filez = filez[:MAXDRUGS]
-    chunked = list(chunks(filez, len(filez)))
+        nprocs = multiprocessing.cpu_count() * 2 + 1
+
+    pool = multiprocessing.Pool(processes=nprocs)
+    def imap(func, items):
+        # Several chunks per worker, so that they finish together
+        return pool.imap(func, items, max(1, len(items) // (nprocs * 4)))
+    try:
+        yield imap
+    finally:
+        pool.terminate()
+        pool.join()
+
+def extract_drugs(args, filelist=None, cache=None):
+    """
+    Top-level drug extraction entrypoint.
 
-    drugdicts = pool.map(_extract_drugs, chunked)
-    return None, merge_dicts(*drugdicts)
+    Parse the files, in a pool of processes if the args say so, and
+    fold the parsed drugs together in file order in this one, so the
+    result is the same as the serial _extract_drugs.
 
+    With a ParseCache, only the files it does not have up to date
+    results for are parsed.
+    """
+    filez = drug_candidates(filelist)
+    # Worked out before the pool forks, so the workers see the link
+    # texts it forgets
+    stale = cache and cache.stale(filez)
+    with mapper(args) as imap:
+        if cache is None:
+            return fold_drugs(imap(parse_drugfile, filez))
+        return fold_drugs(cache.parsed(filez, stale, imap))
 
 def _extract_drugs(filelist=None):
     """
@@ -397,16 +421,25 @@ def _extract_drugs(filelist=None):
     The optional argument filelist is expected to be a list of strings representing
     absolute directory paths to the set of HTML files we want to parse.
     """
+    return fold_drugs(parse_drugfile(f) for f in drug_candidates(filelist))
+
+def drug_candidates(filelist=None):
+    "Return the files (default, every file in HTMLDIR) we try to parse as drugs"
+    return [f for f in (filelist or bnfhtml()) if f.endswith('.htm')]
+
+def fold_drugs(parsed):
+    """
+    Fold the (drug, parent name) results of parse_drugfile for each file,
+    in order, into the set of drugs and the names of each parent's
+    subsections.
+
+    Stop once we have more than MAXDRUGS drugs.
+    """
     drugs = {}
     subsections = collections.defaultdict(list)
-    filez = filelist or bnfhtml()
-    for fname in filez:
+    for drug, parent in parsed:
         if MAXDRUGS is not None and len(drugs) > MAXDRUGS:
             return drugs, subsections
-        #print fname
-        if not fname.endswith('.htm'):
-            continue
-        drug, parent = parse_drugfile(fname)
         if drug:
             if drug['name'] in drugs:
                 if drugs[drug['name']]['doses'] == drug['doses']:
@@ -431,6 +464,105 @@ def _extract_drugs(filelist=None):
             subsections[parent].append(drug['name'])
     return drugs, subsections
 
+def file_manifest(fname, old=None):
+    """
+    Return [size, mtime, sha1] for FNAME as it is now, or None if it has
+    gone. The file is only read again if its size or mtime differ from
+    those in OLD.
+    """
+    try:
+        st = os.stat(fname)
+    except OSError:
+        return None
+    if old and old[0] == st.st_size and old[1] == st.st_mtime:
+        return old
+    with open(fname, 'rb') as fh:
+        return [st.st_size, st.st_mtime, hashlib.sha1(fh.read()).hexdigest()]
+
+class ParseCache(object):
+    """
+    Keep the results of parsing each drug file between runs, so that
+    only what changed is parsed again.
+
+    PATH is a JSON file holding a manifest of the size, mtime and SHA1
+    of every file we have parsed or interpolated links from, and each
+    parsed file's drug, parent and linked files. A file is hashed again
+    only if its size or mtime has moved, and parsed again only if it is
+    new, its content has changed, or that of a file it links to has.
+    """
+    FORMAT = 1
+
+    def __init__(self, path):
+        self.path = path
+        self.files = {}
+        self.results = {}
+        self.reparsed = 0
+        if os.path.exists(path):
+            with open(path, 'r') as fh:
+                data = json.load(fh)
+            if data.get('format') == self.FORMAT:
+                self.files, self.results = data['files'], data['results']
+
+    def manifest(self, fname):
+        "Return [size, mtime, sha1] for FNAME as it is now, or None if it has gone"
+        return file_manifest(fname, self.files.get(fname))
+
+    def changes(self, fnames):
+        """
+        Bring the manifest up to date for FNAMES and the files they
+        linked to, and return the set of those whose content changed.
+        """
+        fnames = set(fnames)
+        for fname in list(fnames):
+            if fname in self.results:
+                fnames.update(self.results[fname][2])
+        changed = set()
+        for fname in fnames:
+            old, new = self.files.get(fname), self.manifest(fname)
+            if new is None:
+                self.files.pop(fname, None)
+            else:
+                self.files[fname] = new
+            if old is None or new is None or old[2] != new[2]:
+                changed.add(fname)
+        return changed
+
+    def stale(self, fnames):
+        """
+        Bring the manifest up to date and return those of FNAMES we have
+        no current result for.
+
+        The texts LINKS resolved from files that changed are forgotten,
+        so call this before forking any processes to parse with: they
+        would keep the old ones.
+        """
+        known = set(self.files)
+        changed = self.changes(fnames)
+        # Links to new files cannot have been resolved from what we knew
+        LINKS.forget(changed & known)
+        return [f for f in fnames if f in changed or f not in self.results
+                or any(l in changed for l in self.results[f][2])]
+
+    def parsed(self, fnames, stale, imap=itertools.imap):
+        """
+        Return the (drug, parent) results of parse_drugfile for each of
+        FNAMES, parsing with IMAP the STALE ones, and save the cache.
+        """
+        for fname, result in itertools.izip(stale, imap(parse_drugfile_links, stale)):
+            self.results[fname] = list(result)
+            for link in result[2]:
+                if link not in self.files and os.path.exists(link):
+                    self.files[link] = self.manifest(link)
+        self.reparsed = len(stale)
+        self.save()
+        return [tuple(self.results[f][:2]) for f in fnames]
+
+    def save(self):
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        with open(tmp, 'w') as fh:
+            json.dump({'format': self.FORMAT, 'files': self.files, 'results': self.results}, fh)
+        os.rename(tmp, self.path)
+
 def is_drugfile(root):
     """
     Given a representation of a page's markup, decide whether it is a
@@ -450,30 +582,156 @@ def is_drugfile(root):
         return False
     return True
 
-def interpolate_links(dom, basename):
+class LinkResolver(object):
+    """
+    Resolve the targets of links between BNF pages to the page title
+    and the cleaned text of the anchored element, parsing each target
+    page at most once.
+
+    The last MAXPAGES parsed pages are kept; resolved titles and texts
+    are kept for the whole run.
+
+    With an INDEXFILE every resolution is also appended to it as a line
+    of JSON, and any lines other processes have appended are read back
+    before we parse a page ourselves. Worker processes forked from the
+    process that created the resolver share its lock, so a page parsed
+    by one worker, or by a previous run, is not parsed again.
+
+    Each line records the file_manifest() of the page it was resolved
+    from, and is only read back while the page still has that content,
+    so a previous run's texts are not used for a page that has changed
+    since.
+    """
+    def __init__(self, indexfile=None, maxpages=64):
+        self.indexfile = indexfile
+        self.maxpages = maxpages
+        self.lock = multiprocessing.Lock()
+        self.offset = 0
+        self.titles = {}
+        self.texts = {}
+        self.pages = collections.OrderedDict()
+        self.manifests = {}
+        self.parsed = 0
+        self.sync()
+
+    def manifest(self, fname, old=None):
+        "Return file_manifest(FNAME, OLD), as it was when first asked for in this run"
+        if fname not in self.manifests:
+            self.manifests[fname] = file_manifest(fname, old)
+        return self.manifests[fname]
+
+    def current(self, entry):
+        "Whether the page the index file ENTRY was resolved from is unchanged"
+        old = entry.get('manifest')
+        if not old:
+            return False
+        new = self.manifest(entry['file'], old)
+        return new is not None and new[2] == old[2]
+
+    def sync(self):
+        "Read the resolutions appended to the index file since we last looked"
+        if not self.indexfile or not os.path.exists(self.indexfile):
+            return
+        with self.lock:
+            with open(self.indexfile, 'r') as fh:
+                fh.seek(self.offset)
+                for line in fh:
+                    entry = json.loads(line)
+                    if entry.get('forget'):
+                        self.drop([entry['file']])
+                        continue
+                    if not self.current(entry):
+                        continue
+                    self.titles[entry['file']] = entry['title']
+                    self.texts[(entry['file'], entry['anchor'])] = entry['text']
+                self.offset = fh.tell()
+
+    def drop(self, fnames):
+        fnames = set(fnames)
+        for key in [k for k in self.texts if k[0] in fnames]:
+            del self.texts[key]
+        for fname in fnames:
+            self.titles.pop(fname, None)
+            self.pages.pop(fname, None)
+            self.manifests.pop(fname, None)
+
+    def forget(self, fnames):
+        """
+        Drop what we know of the pages FNAMES, which have changed, so
+        that they are parsed again when next linked to, here and by
+        later runs that read the index file.
+        """
+        self.drop(fnames)
+        if self.indexfile:
+            with self.lock:
+                with open(self.indexfile, 'a') as fh:
+                    for fname in fnames:
+                        fh.write(json.dumps({'file': fname, 'forget': True}) + '\n')
+
+    def root(self, fname):
+        "Return the parsed page FNAME"
+        if fname in self.pages:
+            root = self.pages.pop(fname)
+        else:
+            with open(fname, 'r') as fh:
+                root = html.parse(fh).getroot()
+            self.parsed += 1
+        self.pages[fname] = root
+        if len(self.pages) > self.maxpages:
+            self.pages.popitem(last=False)
+        return root
+
+    def resolve(self, fname, anchor):
+        "Return (title, text) for the element with id ANCHOR in the page FNAME"
+        key = (fname, anchor)
+        if key not in self.texts:
+            self.sync()
+        if key not in self.texts:
+            manifest = self.manifest(fname)
+            root = self.root(fname)
+            title = root.cssselect('title')[0].text_content()
+            text = re.sub(_paragraph_re, ' ', root.get_element_by_id(anchor).text_content())
+            self.titles[fname] = title
+            self.texts[key] = text
+            if self.indexfile:
+                entry = json.dumps({'file': fname, 'anchor': anchor, 'title': title,
+                                    'text': text, 'manifest': manifest})
+                with self.lock:
+                    with open(self.indexfile, 'a') as fh:
+                        fh.write(entry + '\n')
+        return self.titles[fname], self.texts[key]
+
+# Replaced by main() when --links is given
+LINKS = LinkResolver()
+
+def interpolate_links(dom, basename, resolver=None):
     """
     Given a section of the DOM from an HTML Document containing
     'See Notes Above' links, interpolate the contents of that
     section into this Drug section.
+
+    Link targets are looked up with RESOLVER (default LINKS).
+
+    Return the list of files linked to.
     """
+    resolver = resolver or LINKS
+    linked = []
     links = dom.cssselect('a')
     for link in links:
         href, anchor= link.attrib['href'], None
         if href.find('#') != -1:
             href, anchor = href.split('#')
         linkfile = os.path.join(basename, href)
-        root = html.parse(open(linkfile, 'r')).getroot()
-        title = root.cssselect('title')[0].text_content()
+        linked.append(linkfile)
         if anchor:
-            related = root.get_element_by_id(anchor).text_content()
-            related = re.sub(_paragraph_re, ' ', related)
+            title, related = resolver.resolve(linkfile, anchor)
             link.text = u"%s\n(From {0})\n{1}".format(title, related)
         else:
             import ipdb
             ipdb.set_trace()
             above = True
 
-    return
+    return linked
 
 def parse_drugfile(fname):
     """
@@ -485,15 +743,24 @@ def parse_drugfile(fname):
     * Filename (Reference)
     * Breadcrumbs (Taxonomy)
     """
+    drug, parent, links = parse_drugfile_links(fname)
+    return drug, parent
+
+def parse_drugfile_links(fname):
+    """
+    As parse_drugfile, but also return the list of files whose content
+    was interpolated into the drug.
+    """
     root = html.parse(open(fname)).getroot()
     # if not root:
     #     import ipdb
     #     ipdb.set_trace()
 
     if not is_drugfile(root):
-        return None, None
+        return None, None, []
 
     drug = {'fname': fname, 'doses': []}
+    links = []
     # Get the name of the current drug.
     # The name can be convoluted and not actually what appears in the H! tag.
     # thus we deal with the 'sub-section' problem here.
@@ -537,7 +804,7 @@ def parse_drugfile(fname):
             if sect.text_content().lower().find('see notes above') != -1:
                 # We don't deal with alternative spellings of see notes here...
                 # /home/david/src/nhshackday/bnf-html/www.medicinescomplete.com/mc/bnf/current/3070.htm
-                interpolate_links(sect, os.path.dirname(fname))
+                links += interpolate_links(sect, os.path.dirname(fname))
                 content = re.sub(r'see %s', '', sect.text_content())#Marker to kill the annoying 'see'
                 drug[title.lower()] = content
             else:
@@ -571,22 +838,150 @@ def parse_drugfile(fname):
                 drug['doses'].remove(dose)
         drug['doses'].append(u'Name[{0}] {1}'.format(brandname, dosetext))
     log.debug(drug)
-    return drug, parent_name
-
-# def make_backrefs(interactions):
-#     "Improve the data, by properly cross referencing"
-#     drugs = interactions.keys()
-#     for name, data in interactions.items():
-#         ldesc = data['interaction'].lower()
-#         for d in drugs:
-#             if ldesc.find(d.lower()) != -1 and ldesc != name.lower():
-#                 interactions[d]['backrefs'].append(name)
-#     return interactions
-
-# def interact():
-#     "do the full interaction"
-#     raw = extract_interactions()
-#     interactions = make_backrefs(raw)
+    return drug, parent_name, links
+
+class NameMatcher(object):
+    """
+    Find every occurrence of a set of names in a text in one pass, with
+    an Aho-Corasick automaton.
+
+    Matching ignores case, and only whole words count: PARACETAMOL is
+    not found in 'co-codamol and paracetamolic'. Where names overlap the
+    leftmost, then longest, wins, so 'sodium valproate' is one match
+    rather than two.
+    """
+    def __init__(self, names=()):
+        # State 0 is the root. goto[s] maps a character to the next
+        # state, fail[s] is the state for the longest proper suffix of
+        # s that is also a prefix of a name, and out[s] lists the
+        # (length, value) of every name ending at s.
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        self.built = False
+        for name, value in names:
+            self.add(name, value)
+
+    def add(self, name, value):
+        "Report VALUE wherever NAME occurs"
+        state = 0
+        for char in name.lower():
+            nxt = self.goto[state].get(char)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[state][char] = nxt
+            state = nxt
+        self.out[state].append((len(name), value))
+        self.built = False
+
+    def build(self):
+        "Compute the failure links, breadth first"
+        queue = collections.deque(self.goto[0].values())
+        for state in queue:
+            self.fail[state] = 0
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(char, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+        self.built = True
+
+    def finditer(self, text):
+        "Yield (start, end, value) for every whole-word match in TEXT"
+        if not self.built:
+            self.build()
+        text = text.lower()
+        state = 0
+        for i, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, value in self.out[state]:
+                start, end = i - length + 1, i + 1
+                if ((start == 0 or not text[start - 1].isalnum()) and
+                    (end == len(text) or not text[end].isalnum())):
+                    yield start, end, value
+
+    def find(self, text):
+        "Return the values of the non-overlapping matches in TEXT, leftmost longest"
+        matches = sorted(self.finditer(text), key=lambda m: (m[0], m[0] - m[1]))
+        found = []
+        end = 0
+        for start, stop, value in matches:
+            if start >= end:
+                found.append(value)
+                end = stop
+        return found
+
+# Brand names are recorded in doses as 'Name[BRAND] ...' (see parse_drugfile)
+_brand_re = re.compile(r'^Name\[([^\]]+)\]')
+
+def drug_aliases(drugs, synonyms=None):
+    """
+    Yield (alias, drug name) for every name we should recognise in
+    DRUGS' text: each drug's own name, its brand names, and any
+    SYNONYMS ({alias: drug name}).
+    """
+    for name, drug in drugs.items():
+        yield name, name
+        for dose in drug.get('doses', []):
+            match = _brand_re.match(dose)
+            if match:
+                yield match.group(1).strip(), name
+    for alias, name in (synonyms or {}).items():
+        if name in drugs:
+            yield alias, name
+
+def drug_texts(drug):
+    "Yield (section, text) for the free text of DRUG we look for references in"
+    interactions = drug.get('interactions')
+    if isinstance(interactions, dict):
+        yield 'interactions', interactions.get('interaction', u'')
+    for sect in DRUGSECTS:
+        if drug.get(sect):
+            yield sect, drug[sect]
+
+def make_xrefs(drugs, synonyms=None):
+    """
+    Cross reference DRUGS, a dict of drug dicts keyed by name.
+
+    Every drug gets `xrefs`: {'mentions': [the drugs its text names],
+    'mentioned_by': [the drugs whose text names it]}. Drugs with an
+    interactions table also get its `mentions`: the drugs their own
+    interaction text names, and its `backrefs`: the drugs whose
+    interaction text names them.
+
+    All the names are compiled into one NameMatcher, so each text is
+    scanned once, whatever the number of drugs.
+    """
+    matcher = NameMatcher(drug_aliases(drugs, synonyms))
+    mentions = dict((name, set()) for name in drugs)
+    mentioned_by = dict((name, set()) for name in drugs)
+    interacts = dict((name, set()) for name in drugs)
+    backrefs = dict((name, set()) for name in drugs)
+    for name, drug in drugs.items():
+        for sect, text in drug_texts(drug):
+            for other in matcher.find(text):
+                if other != name:
+                    mentions[name].add(other)
+                    mentioned_by[other].add(name)
+                    if sect == 'interactions':
+                        interacts[name].add(other)
+                        backrefs[other].add(name)
+    for name, drug in drugs.items():
+        drug['xrefs'] = {'mentions': sorted(mentions[name]),
+                         'mentioned_by': sorted(mentioned_by[name])}
+        if isinstance(drug.get('interactions'), dict):
+            drug['interactions']['mentions'] = sorted(interacts[name])
+            drug['interactions']['backrefs'] = sorted(backrefs[name])
+    return drugs
 
 def drugfiles(args): # UI Helper fn
     "Print the list of files for which is_drugfile() is True"
@@ -602,6 +997,9 @@ def drugdict(args): # UI Helper fn
     If the -f option was passed, assume the file to contain a collection
     of files to parse, separated by \n and iterate through this rather
     than parsing the entire Document collection.
+
+    With --ndjson, print one drug per line instead, for loadmongo.py to
+    read as a stream.
     """
     if args.file:
         filez = open(args.file, 'r').read().split("\n")
@@ -610,12 +1008,33 @@ def drugdict(args): # UI Helper fn
     else:
         filez = None
 
-    log.debug('%s filez', len(filez))
-    drugd, subsections = extract_drugs(args, filelist=filez)
-    print json.dumps(drugd,indent=2)
+    log.debug('%s filez', len(filez or []))
+    cache = ParseCache(args.cache) if args.cache else None
+    drugd, subsections = extract_drugs(args, filelist=filez, cache=cache)
+    if cache:
+        log.debug('%s files parsed', cache.reparsed)
+    if args.ndjson:
+        write_ndjson(drugd, sys.stdout)
+    else:
+        print json.dumps(drugd,indent=2)
     log.debug(subsections)
     return
 
+def xref(args): # UI Helper fn
+    """
+    Read a drugdict from args.file, cross reference it, and print it.
+
+    With --ndjson, read and print one drug per line, and take - to
+    mean stdin.
+    """
+    synonyms = ld(args.synonyms) if args.synonyms else None
+    if args.ndjson:
+        fh = sys.stdin if args.file == '-' else open(args.file, 'r')
+        write_ndjson(make_xrefs(read_ndjson(fh), synonyms), sys.stdout)
+    else:
+        print json.dumps(make_xrefs(ld(args.file), synonyms), indent=2)
+    return
+
 def dupdetect(args): # UI Helper
     """
     Detect Documents with duplicate worthwhile semantic content
@@ -647,6 +1066,8 @@ def main():
     parser.add_argument('-p', '--processes', type=int, default=-1,
                         help='Number of Processes to use')
     parser.add_argument('-d', '--debug', help='Print debugging information')
+    parser.add_argument('--links', type=str,
+                        help='File to keep resolved link targets in, across runs and processes')
     subparsers = parser.add_subparsers(title='Actions')
 
     parser_drugfiles = subparsers.add_parser(
@@ -671,8 +1092,25 @@ def main():
                                  action = 'store_true')
     parser_drugdict.add_argument('-o', '--offset', type=int,
                                  help='Begin at this offset in --file')
+    parser_drugdict.add_argument('-c', '--cache', type=str,
+                                 help='File to keep parsed files in, so that later runs '
+                                 'only parse what has changed')
+    parser_drugdict.add_argument('--ndjson', action='store_true',
+                                 help='Print one drug per line')
     parser_drugdict.set_defaults(func=drugdict)
 
+    parser_xref = subparsers.add_parser(
+        'xref',
+        help='Cross reference the drugs in a drugdict, and print it'
+        )
+    parser_xref.add_argument('file', type=str,
+                             help='JSON output of drugdict')
+    parser_xref.add_argument('-s', '--synonyms', type=str,
+                             help='JSON file of {synonym: drug name}')
+    parser_xref.add_argument('--ndjson', action='store_true',
+                             help='Read and print one drug per line')
+    parser_xref.set_defaults(func=xref)
+
     parser_test = subparsers.add_parser('test', help='Run our Unittests')
     parser_test.set_defaults(func=unittest.main)
 
@@ -684,6 +1122,9 @@ def main():
     if args.htmldir:
         global HTMLDIR
         HTMLDIR = args.htmldir
+    if args.links:
+        global LINKS
+        LINKS = LinkResolver(args.links)
     if args.debug:
         global log
         log.setLevel('DEBUG')
@@ -0,0 +1,207 @@
+"""
+OpenBNF search query syntax
+
+Search terms are case-insensitive substrings of drug names. They can
+be combined:
+
+    sodium | acid          Either  (also: OR, a semicolon or newline)
+    sodium AND acid        Both    (also: juxtaposed phrases or groups)
+    sodium NOT valproate   The first without the second
+    "fusidic acid"         A quoted phrase is always taken literally
+                           (an empty one matches nothing)
+    (a | b) AND c          Grouping
+
+Runs of plain words are a single term, so "fusidic acid" still means
+the substring "fusidic acid" as it always has. Operators are only
+recognised in upper case. Queries we cannot parse, and those that are
+exactly the name of a drug (some have commas, brackets or an AND in
+them), are treated as one literal term.
+
+A query is parsed once into a tree of ('term', text), ('nothing',),
+('or', [nodes]), ('and', [nodes]) and ('not', node), and evaluated in a single pass over
+an indexes.NgramIndex as set operations on index slots.
+"""
+import re
+
+import indexes
+
+OR, AND, NOT, LPAREN, RPAREN, PHRASE, WORD = (
+    'OR', 'AND', 'NOT', 'LPAREN', 'RPAREN', 'PHRASE', 'WORD')
+
+KEYWORDS = {'OR': OR, 'AND': AND, 'NOT': NOT}
+
+_token_re = re.compile(r'''
+    "(?P<phrase>[^"]*)"?      # Quoted phrase, forgiving a missing close quote
+  | (?P<or>[|;\n])
+  | (?P<lparen>\()
+  | (?P<rparen>\))
+  | (?P<word>[^\s|;"()]+)
+''', re.VERBOSE)
+
+
+class QuerySyntaxError(ValueError):
+    "Raised for queries that are not well formed"
+
+
+def tokenise(query):
+    """
+    Return a list of (kind, text, start, end) tuples for QUERY.
+    """
+    tokens = []
+    for match in _token_re.finditer(query):
+        if match.group('phrase') is not None:
+            kind = PHRASE
+            text = match.group('phrase')
+        elif match.group('or'):
+            kind, text = OR, match.group('or')
+        elif match.group('lparen'):
+            kind, text = LPAREN, '('
+        elif match.group('rparen'):
+            kind, text = RPAREN, ')'
+        else:
+            text = match.group('word')
+            kind = KEYWORDS.get(text, WORD)
+        tokens.append((kind, text, match.start(), match.end()))
+    return tokens
+
+
+class Parser(object):
+    """
+    Recursive descent parser for the query grammar:
+
+        expr    := andexpr (OR andexpr)*
+        andexpr := notexpr ([AND] notexpr)*
+        notexpr := NOT notexpr | atom
+        atom    := PHRASE | WORD+ | '(' expr ')'
+    """
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenise(query)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos][0]
+        return None
+
+    def take(self, kind):
+        if self.peek() != kind:
+            raise QuerySyntaxError('Expected {0} at token {1}'.format(kind, self.pos))
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        if not self.tokens:
+            return ('term', u'')
+        node = self.expr()
+        if self.pos != len(self.tokens):
+            raise QuerySyntaxError('Unexpected {0}'.format(self.tokens[self.pos][1]))
+        return node
+
+    def expr(self):
+        nodes = [self.andexpr()]
+        while self.peek() == OR:
+            self.take(OR)
+            # Tolerate trailing and doubled separators in pasted lists
+            if self.peek() in (None, OR, RPAREN):
+                continue
+            nodes.append(self.andexpr())
+        return nodes[0] if len(nodes) == 1 else ('or', nodes)
+
+    def andexpr(self):
+        nodes = [self.notexpr()]
+        while self.peek() in (AND, NOT, PHRASE, WORD, LPAREN):
+            if self.peek() == AND:
+                self.take(AND)
+            nodes.append(self.notexpr())
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+    def notexpr(self):
+        if self.peek() == NOT:
+            self.take(NOT)
+            return ('not', self.notexpr())
+        return self.atom()
+
+    def atom(self):
+        kind = self.peek()
+        if kind == PHRASE:
+            text = self.take(PHRASE)[1]
+            # A stray quote must not turn into a term every name contains
+            return ('term', text) if text else ('nothing',)
+        if kind == LPAREN:
+            self.take(LPAREN)
+            node = self.expr()
+            self.take(RPAREN)
+            return node
+        if kind == WORD:
+            start = end = self.take(WORD)[2:]
+            while self.peek() == WORD:
+                end = self.take(WORD)[2:]
+            # Keep the original spacing of the run of words
+            return ('term', self.query[start[0]:end[1]])
+        raise QuerySyntaxError('Unexpected end of query')
+
+
+def parse(query):
+    """
+    Parse QUERY into a query tree, falling back to a single literal
+    term when it is not well formed.
+    """
+    try:
+        return Parser(query).parse()
+    except QuerySyntaxError:
+        return ('term', query.strip())
+
+
+def evaluate(node, index):
+    """
+    Return the set of INDEX slots matching the query tree NODE.
+
+    Conjunctions are planned rather than evaluated literally: positive
+    branches are intersected smallest first and negated branches are
+    subtracted from the result, so 'a NOT b' never materialises the
+    complement of b.
+    """
+    kind = node[0]
+    if kind == 'term':
+        return index.slots(node[1])
+    if kind == 'nothing':
+        return set()
+    if kind == 'or':
+        result = set()
+        for child in node[1]:
+            result |= evaluate(child, index)
+        return result
+    if kind == 'not':
+        return set(range(len(index))) - evaluate(node[1], index)
+    if kind == 'and':
+        positive = [evaluate(c, index) for c in node[1] if c[0] != 'not']
+        negative = [c[1] for c in node[1] if c[0] == 'not']
+        if positive:
+            positive.sort(key=len)
+            result = set(positive[0])
+            for slots in positive[1:]:
+                result &= slots
+        else:
+            result = set(range(len(index)))
+        for child in negative:
+            if not result:
+                break
+            result -= evaluate(child, index)
+        return result
+    raise ValueError('Unknown query node {0}'.format(kind))
+
+
+def search(query, index):
+    """
+    Return the de-duplicated keys of every INDEX entry matching QUERY,
+    in index order.
+    """
+    node = parse(query)
+    if node[0] != 'term':
+        literal = index.slots(query.strip())
+        name = indexes.normalise(query.strip())
+        if any(index.texts[s] == name for s in literal):
+            return [index.keys[s] for s in sorted(literal)]
+    return [index.keys[s] for s in sorted(evaluate(node, index))]
@@ -1,6 +1,7 @@
 """
 Settings for OPENBNF
 """
+import multiprocessing
 import os
 import urlparse
 
@@ -10,6 +11,102 @@ DB_PORT = 27017
 DB_USER = None
 DB_PASS = None
 
+# Sockets each web worker may hold open to MongoDB, and how long (in
+# seconds) to wait to connect and for replies. None waits forever.
+DB_POOL_SIZE = int(os.environ.get('OPENBNF_DB_POOL_SIZE', 10))
+DB_CONNECT_TIMEOUT = 5
+DB_SOCKET_TIMEOUT = 30
+
+# Production serving (see wsgi.py and gunicorn.conf.py). Workers are
+# processes; WEB_CONCURRENCY is the Heroku convention for their number.
+# Workers silent for WEB_TIMEOUT seconds are killed and restarted, and
+# on shutdown get WEB_GRACEFUL_TIMEOUT seconds to finish their requests.
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+WEB_WORKER_CLASS = os.environ.get('OPENBNF_WORKER_CLASS', 'sync')
+WEB_TIMEOUT = 30
+WEB_GRACEFUL_TIMEOUT = 30
+
+# Every request is timed for /metrics. This fraction of them, and any
+# taking longer than REQUEST_LOG_SLOW seconds, are also logged.
+REQUEST_LOG_SAMPLE = float(os.environ.get('OPENBNF_LOG_SAMPLE', 0.01))
+REQUEST_LOG_SLOW = 1.0
+
+# With several worker processes, each writes its metrics to a file in
+# METRICS_DIR every METRICS_FLUSH seconds, and /metrics adds them up.
+# gunicorn.conf.py makes a temporary directory if none is given.
+METRICS_DIR = os.environ.get('OPENBNF_METRICS_DIR')
+METRICS_FLUSH = 1.0
+
+# Flask debugging and the reloader. Never turn this on in production.
+DEBUG = os.environ.get('OPENBNF_DEBUG', '') not in ('', '0')
+
+# Where drugs are stored: 'mongo' (loadmongo.py), 'sqlite' (loadsqlite.py)
+# or 'snapshot' (loadsnapshot.py)
+STORE_BACKEND = os.environ.get('OPENBNF_STORE', 'mongo')
+SQLITE_PATH = os.environ.get('OPENBNF_SQLITE',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openbnf.sqlite'))
+SNAPSHOT_PATH = os.environ.get('OPENBNF_SNAPSHOT',
+                               os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openbnf.snapshot'))
+
+# Pickled in-process indexes, written by the loaders (see dataset.py) so
+# that workers needn't read every drug to build them. Set to '' to always
+# build from the store. With LAZY_INDEXES they are loaded on the first
+# request that needs them rather than when app.py is imported.
+INDEX_ARTIFACT = os.environ.get('OPENBNF_INDEXES',
+                                os.path.join(os.path.dirname(os.path.abspath(__file__)), 'openbnf.indexes'))
+LAZY_INDEXES = os.environ.get('OPENBNF_LAZY_INDEXES', '') not in ('', '0')
+
+# "Did you mean" suggestions for searches with no hits.
+# SUGGEST_CUTOFF is the minimum similarity ratio (0-1) a name must reach,
+# SUGGEST_CANDIDATES the number of trigram-filtered names we score exactly.
+SUGGEST_LIMIT = 3
+SUGGEST_CUTOFF = 0.6
+SUGGEST_CANDIDATES = 200
+
+# /ajaxsearch completions. Ranking criteria are applied in order, and
+# may be any of 'prefix' (prefix before infix matches), 'length'
+# (shorter names first) and 'name' (alphabetical).
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_RANKING = ('prefix', 'length', 'name')
+
+# /search result pages
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_PAGE_SIZE = 200
+
+# Free-text drug sections we index for ranked search (see parser.DRUGSECTS)
+TEXT_FIELDS = ('indications', 'cautions', 'side-effects', 'pregnancy')
+
+# Answer text searches from an in-process index ('memory'), or with the
+# storage backend's own search ('store': ranked FTS5 for sqlite, an
+# unranked scan for mongo and snapshot) to save building the index in
+# every worker.
+TEXT_SEARCH = 'memory'
+
+# Default and maximum number of results per API call
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Largest number of BNF codes /api/v2/drugs will resolve in one request
+MAX_BATCH_CODES = 200
+
+# Largest number of drugs /api/v2/interactions will check in one request
+MAX_INTERACTION_DRUGS = 50
+
+# Number of drugs fetched per database round trip when streaming
+STREAM_BATCH_SIZE = 100
+
+# Number of drugs loadmongo.py inserts per database round trip, and the
+# number of those inserts it keeps in flight at once
+LOAD_BATCH_SIZE = int(os.environ.get('OPENBNF_LOAD_BATCH_SIZE', 500))
+LOAD_WRITERS = int(os.environ.get('OPENBNF_LOAD_WRITERS', 4))
+
+# Each loader stamps the dataset with a version. We look it up at most
+# once every DATASET_VERSION_TTL seconds, and when it changes rebuild the
+# in-process indexes and empty the cache of rendered responses.
+RESPONSE_CACHE_BYTES = int(os.environ.get('OPENBNF_RESPONSE_CACHE_BYTES', 64 * 1024 * 1024))
+DATASET_VERSION_TTL = 5
+CACHE_MAX_AGE = 300
+
 
 if 'MONGOHQ_URL' in os.environ:
     url = urlparse.urlparse(os.environ['MONGOHQ_URL'])
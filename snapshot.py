@@ -0,0 +1,226 @@
+"""
+OpenBNF memory-mapped snapshot
+
+A compact, read-only binary copy of the formulary that web workers
+mmap rather than load. Every worker maps the same file, so they share
+one copy in the page cache, and a drug's JSON is only decoded when a
+request asks for it.
+
+The file is laid out as
+
+    header   magic, counts and the offsets of everything below
+    data     each drug's name and JSON document, then every BNF code
+    records  per drug, in load order: (doc offset, doc length,
+                                       name offset, name length)
+    names    (name offset, name length, record) sorted by name
+    codes    (code offset, code length, record) sorted by code
+    meta     JSON: the dataset version
+
+Names and codes are looked up by binary search of their tables.
+Keys compare as UTF-8 bytes.
+
+Build one with loadsnapshot.py and select it with
+settings.STORE_BACKEND = 'snapshot'.
+"""
+import collections
+import json
+import mmap
+import os
+import struct
+
+MAGIC = 'OBNFSNP1'
+HEADER = struct.Struct('<8sIIQQQQQ')
+RECORD = struct.Struct('<QIQI')
+KEY = struct.Struct('<QII')
+
+def build(path, drugs, version):
+    """
+    Write DRUGS (with their `codes` already joined on) to a new
+    snapshot at PATH.
+
+    The snapshot is built next to PATH and renamed over it, so workers
+    that have the old one mapped keep reading a complete file.
+    """
+    tmp = path + '.tmp'
+    records, names, codes = [], [], []
+    with open(tmp, 'wb') as fh:
+        fh.write('\0' * HEADER.size)
+
+        def put(data):
+            offset = fh.tell()
+            fh.write(data)
+            return offset, len(data)
+
+        for rowid, drug in enumerate(drugs):
+            name = drug['name'].encode('utf-8')
+            name_at = put(name)
+            records.append(put(json.dumps(drug)) + name_at)
+            names.append((name, name_at, rowid))
+            for code in drug.get('codes', []):
+                code = code.encode('utf-8')
+                codes.append((code, put(code), rowid))
+
+        tables = []
+        records_at = fh.tell()
+        for record in records:
+            fh.write(RECORD.pack(*record))
+        for table in (names, codes):
+            tables.append(fh.tell())
+            for key, (offset, length), rowid in sorted(table):
+                fh.write(KEY.pack(offset, length, rowid))
+        meta = put(json.dumps({'version': version}))
+
+        fh.seek(0)
+        fh.write(HEADER.pack(MAGIC, len(records), len(codes),
+                             records_at, tables[0], tables[1], *meta))
+    os.rename(tmp, path)
+
+
+class Snapshot(object):
+    """
+    A snapshot file mapped read-only into memory.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as fh:
+            self.inode = os.fstat(fh.fileno()).st_ino
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, self.count, self.ncodes, self.records, self.names,
+         self.codes, meta, metalen) = HEADER.unpack_from(self.mm)
+        if magic != MAGIC:
+            raise IOError('{0} is not an OpenBNF snapshot'.format(path))
+        self.meta = json.loads(self.mm[meta:meta + metalen])
+
+    def __len__(self):
+        return self.count
+
+    def name(self, rowid):
+        _, _, offset, length = RECORD.unpack_from(self.mm, self.records + rowid * RECORD.size)
+        return self.mm[offset:offset + length].decode('utf-8')
+
+    def drug(self, rowid):
+        offset, length, _, _ = RECORD.unpack_from(self.mm, self.records + rowid * RECORD.size)
+        return json.loads(self.mm[offset:offset + length])
+
+    def find(self, table, size, key):
+        """
+        Return the record for KEY in the sorted TABLE of SIZE entries,
+        or None.
+        """
+        key = key.encode('utf-8')
+        lo, hi = 0, size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset, length, rowid = KEY.unpack_from(self.mm, table + mid * KEY.size)
+            probe = self.mm[offset:offset + length]
+            if probe == key:
+                return rowid
+            if probe < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def by_name(self, name):
+        return self.find(self.names, self.count, name)
+
+    def by_code(self, code):
+        return self.find(self.codes, self.ncodes, code)
+
+
+class SnapshotStore(object):
+    """
+    Storage backend reading a file written by build().
+
+    The mapping is inherited across a fork and shared between threads.
+    A new mapping is made when a new build has been renamed over the
+    file. The one before it is kept, so that at() can still read the
+    dataset the web tier's indexes were built from until they are
+    replaced. Older ones are released once nothing refers to them.
+    """
+    KEEP = 2
+
+    def __init__(self, path, pinned=None):
+        self.path = path
+        self.pinned = pinned
+        self.mapped = collections.OrderedDict()
+
+    @property
+    def snapshot(self):
+        if self.pinned is not None:
+            return self.pinned
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            raise IOError('No snapshot at {0}: run loadsnapshot.py'.format(self.path))
+        current = self.mapped.get(inode)
+        if current is None:
+            current = Snapshot(self.path)
+            mapped = self.mapped.copy()
+            mapped[current.inode] = current
+            while len(mapped) > self.KEEP:
+                mapped.popitem(last=False)
+            self.mapped = mapped
+        return current
+
+    def at(self, inode):
+        """
+        Return a SnapshotStore reading the build with INODE, or the
+        current one if we no longer have it mapped.
+        """
+        return SnapshotStore(self.path, self.mapped.get(inode))
+
+    def current(self):
+        snapshot = self.snapshot
+        return snapshot.meta.get('version'), snapshot.inode
+
+    def iter_drugs(self, fields=None):
+        snapshot = self.snapshot
+        for rowid in xrange(len(snapshot)):
+            if fields is not None and not fields:
+                # Names are stored apart from the documents, so listing
+                # them decodes nothing else.
+                yield {'name': snapshot.name(rowid)}
+                continue
+            drug = snapshot.drug(rowid)
+            if fields is not None:
+                drug = dict((k, drug[k]) for k in ['name'] + list(fields) if k in drug)
+            yield drug
+
+    def drug_by_name(self, name):
+        snapshot = self.snapshot
+        rowid = snapshot.by_name(name)
+        return None if rowid is None else snapshot.drug(rowid)
+
+    def drugs_by_name(self, names):
+        snapshot = self.snapshot
+        rowids = [snapshot.by_name(n) for n in names]
+        return [snapshot.drug(r) for r in rowids if r is not None]
+
+    def drug_by_code(self, code):
+        snapshot = self.snapshot
+        rowid = snapshot.by_code(code)
+        return None if rowid is None else snapshot.drug(rowid)
+
+    def drugs_by_code(self, codes):
+        snapshot = self.snapshot
+        drugs = {}
+        for code in codes:
+            rowid = snapshot.by_code(code)
+            if rowid is not None:
+                drugs[code] = snapshot.drug(rowid)
+        return drugs
+
+    def search_text(self, term, fields):
+        """
+        Case-insensitive substring scan of FIELDS, decoding every drug.
+        The snapshot has no text index, and the results are not ranked.
+        """
+        term = term.lower()
+        names = []
+        for drug in self.iter_drugs(fields):
+            if any(term in (drug.get(f) or u'').lower() for f in fields):
+                names.append(drug['name'])
+        return names
+
+    def dataset_version(self):
+        return self.snapshot.meta.get('version')
@@ -0,0 +1,227 @@
+"""
+OpenBNF embedded SQLite store
+
+A read-only, single-file copy of the formulary that each web worker can
+query locally. Drugs are stored as JSON documents keyed by name, BNF
+codes in their own indexed table, and the free-text sections in an
+FTS5 table ranked with bm25().
+
+Build one with loadsqlite.py and select it with
+settings.STORE_BACKEND = 'sqlite'.
+"""
+import collections
+import copy
+import json
+import os
+import sqlite3
+import threading
+
+import indexes
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE drugs (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL, doc TEXT NOT NULL);
+CREATE TABLE codes (code TEXT PRIMARY KEY, drug INTEGER NOT NULL REFERENCES drugs (id));
+"""
+
+# SQLite variables per statement are limited (999 by default)
+BATCH = 500
+
+def column(field):
+    "FTS5 column name for the drug field FIELD"
+    return field.replace('-', '_')
+
+def fts_query(term, fields):
+    """
+    Translate a text search TERM (see indexes.text_clauses) into an
+    FTS5 query restricted to the columns for FIELDS. Every clause is
+    quoted, so nothing the user types is taken as FTS5 syntax.
+    """
+    columns = u'{{{0}}}'.format(u' '.join(column(f) for f in fields))
+    phrases = []
+    for clause in indexes.text_clauses(term):
+        if clause[-1].endswith(u'*'):
+            phrases.append(u'{0} : "{1}" *'.format(columns, clause[-1][:-1]))
+        else:
+            phrases.append(u'{0} : "{1}"'.format(columns, u' '.join(clause)))
+    return u' AND '.join(phrases)
+
+def build(path, drugs, version, fields):
+    """
+    Write DRUGS (with their `codes` already joined on) to a new SQLite
+    store at PATH, indexing the text FIELDS.
+
+    The store is built next to PATH and renamed over it, so readers
+    only ever see a complete file.
+    """
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    conn.executescript(SCHEMA)
+    conn.execute('CREATE VIRTUAL TABLE sections USING fts5({0})'.format(
+        ', '.join(column(f) for f in fields)))
+    for rowid, drug in enumerate(drugs, 1):
+        conn.execute('INSERT INTO drugs (id, name, doc) VALUES (?, ?, ?)',
+                     (rowid, drug['name'], json.dumps(drug)))
+        conn.executemany('INSERT INTO codes (code, drug) VALUES (?, ?)',
+                         [(code, rowid) for code in drug.get('codes', [])])
+        conn.execute('INSERT INTO sections (rowid, {0}) VALUES (?, {1})'.format(
+                ', '.join(column(f) for f in fields), ', '.join('?' for f in fields)),
+                     [rowid] + [drug.get(f) for f in fields])
+    conn.executemany('INSERT INTO meta (key, value) VALUES (?, ?)',
+                     [('version', version), ('fields', json.dumps(list(fields)))])
+    conn.commit()
+    conn.execute('INSERT INTO sections (sections) VALUES (?)', ('optimize',))
+    conn.commit()
+    conn.execute('VACUUM')
+    conn.close()
+    os.rename(tmp, path)
+
+
+class Rows(list):
+    "The rows of a statement, read in full"
+    def fetchone(self):
+        return self[0] if self else None
+
+
+class SharedConnection(object):
+    """
+    A connection to PATH that any thread may use, one statement at a
+    time. Each statement's rows are read in full under the lock.
+    """
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+
+    def execute(self, sql, values=()):
+        with self.lock:
+            return Rows(self.conn.execute(sql, values).fetchall())
+
+
+class SQLiteStore(object):
+    """
+    Storage backend reading a file written by build().
+
+    sqlite3 connections can't be shared between threads or across a
+    fork, so each thread of each process opens its own. A connection
+    is reopened when a new build has been renamed over the file.
+
+    Every build that current() has reported is also held open, up to
+    KEEP of them, by a SharedConnection. Once a new build has replaced
+    it, at() reads it through that, so the web tier can keep reading
+    the dataset its indexes were built from until they are replaced.
+    """
+    KEEP = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.pinned = None
+        self.lock = threading.Lock()
+        self.held = collections.OrderedDict()
+        self.heldby = None
+
+    def inode(self):
+        try:
+            return os.stat(self.path).st_ino
+        except OSError:
+            raise IOError('No SQLite store at {0}: run loadsqlite.py'.format(self.path))
+
+    @property
+    def conn(self):
+        inode = self.inode()
+        if self.pinned is not None and self.pinned != inode:
+            held = self.held.get(self.pinned)
+            if held is not None and self.heldby == os.getpid():
+                return held
+        if getattr(self.local, 'opened', None) != (os.getpid(), inode):
+            self.local.conn = sqlite3.connect(self.path)
+            self.local.opened = (os.getpid(), inode)
+        return self.local.conn
+
+    def hold(self, inode):
+        "Hold the build with INODE open, if it is still the current one"
+        with self.lock:
+            if self.heldby != os.getpid():
+                self.held.clear()
+                self.heldby = os.getpid()
+            if inode in self.held:
+                return
+            held = SharedConnection(self.path)
+            if self.inode() != inode:
+                return
+            self.held[inode] = held
+            while len(self.held) > self.KEEP:
+                self.held.popitem(last=False)
+
+    def at(self, inode):
+        """
+        Return a SQLiteStore reading the build with INODE, or the
+        current one if we don't hold it.
+        """
+        view = copy.copy(self)
+        view.pinned = inode
+        return view
+
+    def current(self):
+        conn = self.conn
+        inode = self.local.opened[1]
+        self.hold(inode)
+        row = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row and row[0], inode
+
+    def select(self, sql, values):
+        """
+        Run SQL once per batch of VALUES, substituting a list of
+        placeholders for {0}, and yield every row.
+        """
+        values = list(values)
+        for i in xrange(0, len(values), BATCH):
+            batch = values[i:i + BATCH]
+            placeholders = ', '.join('?' for v in batch)
+            for row in self.conn.execute(sql.format(placeholders), batch):
+                yield row
+
+    def iter_drugs(self, fields=None):
+        for (doc,) in self.conn.execute('SELECT doc FROM drugs ORDER BY id'):
+            drug = json.loads(doc)
+            if fields is not None:
+                drug = dict((k, drug[k]) for k in ['name'] + list(fields) if k in drug)
+            yield drug
+
+    def drug_by_name(self, name):
+        row = self.conn.execute('SELECT doc FROM drugs WHERE name = ?', (name,)).fetchone()
+        return row and json.loads(row[0])
+
+    def drugs_by_name(self, names):
+        found = dict(self.select('SELECT name, doc FROM drugs WHERE name IN ({0})', names))
+        return [json.loads(found[n]) for n in names if n in found]
+
+    def drug_by_code(self, code):
+        row = self.conn.execute(
+            'SELECT doc FROM drugs JOIN codes ON codes.drug = drugs.id WHERE codes.code = ?',
+            (code,)).fetchone()
+        return row and json.loads(row[0])
+
+    def drugs_by_code(self, codes):
+        rows = self.select(
+            'SELECT codes.code, doc FROM drugs JOIN codes ON codes.drug = drugs.id '
+            'WHERE codes.code IN ({0})', codes)
+        return dict((code, json.loads(doc)) for code, doc in rows)
+
+    def search_text(self, term, fields):
+        """
+        Full-text search of FIELDS through FTS5, best bm25() match first.
+        """
+        match = fts_query(term, fields)
+        if not match:
+            return []
+        rows = self.conn.execute(
+            'SELECT drugs.name FROM sections JOIN drugs ON drugs.id = sections.rowid '
+            'WHERE sections MATCH ? ORDER BY bm25(sections), drugs.id', (match,))
+        return [name for (name,) in rows]
+
+    def dataset_version(self):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return row and row[0]
@@ -0,0 +1,351 @@
+"""
+OpenBNF data access
+
+Every query the web tier and the tools make lives here. They are
+answered by the storage backend chosen with settings.STORE_BACKEND:
+
+* 'mongo'  - MongoStore, the MongoDB database loadmongo.py fills
+* 'sqlite' - sqlitestore.SQLiteStore, a local file loadsqlite.py builds
+* 'snapshot' - snapshot.SnapshotStore, a memory-mapped file that
+  loadsnapshot.py builds, shared by every worker on the host
+
+Callers use the module level functions, which delegate to the backend.
+A source, from current(), pins them to one dataset, so that the web
+tier reads the documents its in-process indexes were built from while
+the next load is being picked up.
+
+Drugs are identified by name, which every backend keeps unique, and
+are returned as plain dicts without any storage-specific fields.
+Searching drug names is done by the in-process indexes (indexes.py),
+which are built from iter_drugs().
+"""
+import datetime
+import functools
+import itertools
+import re
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import metrics
+import settings
+
+
+class MongoStore(object):
+    """
+    MongoDB backend.
+
+    Each load writes a new generation of the drugs collection, and the
+    `dataset` document in `meta` points at the one in use. Flipping that
+    pointer is a single document write, so readers see either the old
+    dataset or the new one, never a half-loaded collection.
+
+    A MongoStore made with a GENERATION (see at()) reads only that one.
+    Otherwise the pointer is looked up again for every query.
+
+    Queries project away `_id` (and anything else the caller doesn't
+    need) on the server, so it never crosses the wire.
+    """
+    # collection -> [(key, options)] for every index we rely on
+    INDEXES = {
+        'drugs': [
+            ('name', {'unique': True}),
+            # Drugs without codes are left out of the index, so that they
+            # don't collide on a null key.
+            ('codes', {'unique': True, 'sparse': True}),
+            ],
+        }
+
+    NO_ID = {'_id': False}
+
+    # Datasets loaded before generations existed live here
+    LEGACY = 'drugs'
+
+    def __init__(self, database=None, generation=None):
+        if database is None:
+            from db import db as database
+        self.db = database
+        self.generation = generation
+
+    def projection(self, fields=None):
+        "Return a projection of FIELDS (or of the whole document) without _id"
+        if fields is None:
+            return self.NO_ID
+        spec = dict((f, True) for f in fields)
+        spec['_id'] = False
+        return spec
+
+    def ensure_indexes(self, generation=None):
+        """
+        Create the indexes declared in INDEXES, if they don't already
+        exist. The drugs indexes go on GENERATION, if given.
+        """
+        for collection, indexes in self.INDEXES.items():
+            if collection == 'drugs' and generation is not None:
+                collection = generation
+            for key, options in indexes:
+                self.db[collection].ensure_index(key, **options)
+
+    def meta(self):
+        "Return the `dataset` document"
+        return self.db.meta.find_one({'_id': 'dataset'})
+
+    def pointed_at(self, meta):
+        "Return the generation the `dataset` document META points at"
+        return (meta or {}).get('collection', self.LEGACY)
+
+    @property
+    def drugs(self):
+        "The drugs collection of our generation, or of the current one"
+        return self.db[self.generation or self.pointed_at(self.meta())]
+
+    def at(self, generation):
+        "Return a MongoStore reading GENERATION"
+        return MongoStore(self.db, generation)
+
+    def current(self):
+        "Return the current dataset version and generation, from one read"
+        meta = self.meta()
+        return meta and meta['version'], self.pointed_at(meta)
+
+    def generations(self):
+        "Return the names of every drugs generation in the database, oldest first"
+        return sorted(n for n in self.db.collection_names()
+                      if n == self.LEGACY or n.startswith(self.LEGACY + '_'))
+
+    def load(self, drugs, version, **extra):
+        """
+        Load DRUGS as a new generation, point the dataset at it, and
+        drop all but it and the one before it, which readers that
+        haven't seen the new pointer may still be using.
+
+        DRUGS may be any iterable, and is inserted by insert(). VERSION
+        may be a function, called once DRUGS is exhausted, for streams
+        that are hashed as they are read.
+
+        The new generation is only pointed at once its indexes are
+        built (which fails on duplicate names or codes) and it holds
+        every drug we inserted. Otherwise it is dropped, and the error
+        raised, leaving the dataset as it was.
+
+        Returns the name of the new generation.
+        """
+        previous = self.pointed_at(self.meta())
+        generation = datetime.datetime.utcnow().strftime(self.LEGACY + '_%Y%m%d%H%M%S%f')
+        try:
+            count = self.insert(self.db[generation], drugs)
+            if callable(version):
+                version = version()
+            self.ensure_indexes(generation)
+            stored = self.db[generation].count()
+            if not count or stored != count:
+                raise ValueError('Inserted {0} drugs into {1}, which holds {2}'.format(
+                        count, generation, stored))
+        except:
+            self.db.drop_collection(generation)
+            raise
+        self.stamp_version(version, collection=generation, **extra)
+        for stale in self.generations():
+            if stale not in (generation, previous):
+                self.db.drop_collection(stale)
+        return generation
+
+    def insert(self, collection, drugs):
+        """
+        Insert DRUGS into COLLECTION settings.LOAD_BATCH_SIZE at a time,
+        with up to settings.LOAD_WRITERS batches in flight at once, and
+        return the number inserted.
+
+        Batches are read from DRUGS only as writers become free, so a
+        stream is never held in memory, and none are read once one has
+        failed. Whether reading or writing failed, every batch already
+        handed to a writer is finished before the error is raised, so
+        nothing is written to COLLECTION after we return.
+        """
+        drugs = iter(drugs)
+        batches = iter(lambda: list(itertools.islice(drugs, settings.LOAD_BATCH_SIZE)), [])
+        if settings.LOAD_WRITERS == 1:
+            count = 0
+            for batch in batches:
+                collection.insert(batch)
+                count += len(batch)
+            return count
+
+        free = threading.BoundedSemaphore(settings.LOAD_WRITERS * 2)
+        failed = threading.Event()
+        def write(batch):
+            try:
+                collection.insert(batch)
+                return len(batch)
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                free.release()
+
+        pool = ThreadPool(settings.LOAD_WRITERS)
+        results = []
+        try:
+            while True:
+                free.acquire()
+                batch = None if failed.is_set() else next(batches, None)
+                if batch is None:
+                    break
+                results.append(pool.apply_async(write, (batch,)))
+        finally:
+            pool.close()
+            pool.join()
+        return sum(r.get() for r in results)
+
+    def iter_drugs(self, fields=None):
+        if fields is not None:
+            fields = ['name'] + list(fields)
+        return self.drugs.find({}, self.projection(fields))
+
+    def drug_by_name(self, name):
+        return self.drugs.find_one({'name': name}, self.projection())
+
+    def drugs_by_name(self, names):
+        if not names:
+            return []
+        found = dict((d['name'], d) for d in
+                     self.drugs.find({'name': {'$in': list(names)}}, self.projection()))
+        return [dict(found[n]) for n in names if n in found]
+
+    def drug_by_code(self, code):
+        return self.drugs.find_one({'codes': code}, self.projection())
+
+    def drugs_by_code(self, codes):
+        drugs = {}
+        for drug in self.drugs.find({'codes': {'$in': list(codes)}}, self.projection()):
+            for code in drug['codes']:
+                drugs[code] = drug
+        return drugs
+
+    def search_text(self, term, fields):
+        """
+        Case-insensitive substring scan of FIELDS. Mongo has no index
+        that can serve this, and the results are not ranked.
+        """
+        pattern = {'$regex': re.escape(term), '$options': 'i'}
+        spec = {'$or': [{f: pattern} for f in fields]}
+        return [d['name'] for d in self.drugs.find(spec, self.projection(['name']))]
+
+    def dataset_version(self):
+        return self.current()[0]
+
+    def stamp_version(self, version, **extra):
+        extra.update({'_id': 'dataset', 'version': version})
+        self.db.meta.save(extra)
+
+
+def instrumented(fn):
+    "Record the time each call of FN takes in metrics"
+    @functools.wraps(fn)
+    def timed(*args, **kwargs):
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            metrics.record_query(fn.__name__, time.time() - start)
+    return timed
+
+_backend = None
+
+def backend():
+    "Return the storage backend configured in settings.STORE_BACKEND"
+    global _backend
+    if _backend is None:
+        if settings.STORE_BACKEND == 'sqlite':
+            import sqlitestore
+            _backend = sqlitestore.SQLiteStore(settings.SQLITE_PATH)
+        elif settings.STORE_BACKEND == 'snapshot':
+            import snapshot
+            _backend = snapshot.SnapshotStore(settings.SNAPSHOT_PATH)
+        elif settings.STORE_BACKEND == 'mongo':
+            _backend = MongoStore()
+        else:
+            raise ValueError('Unknown STORE_BACKEND {0}'.format(settings.STORE_BACKEND))
+    return _backend
+
+def reader(source=None):
+    """
+    Return the backend reading SOURCE, as returned by current(), or
+    when SOURCE is None whatever it serves now.
+    """
+    if source is None:
+        return backend()
+    return backend().at(source)
+
+def iter_drugs(fields=None, source=None):
+    """
+    Yield every drug as a dict, with its name and FIELDS (default all).
+    """
+    # Timed as one query, not counting the time the caller spends on
+    # each drug.
+    drugs = iter(reader(source).iter_drugs(fields))
+    elapsed = 0.0
+    while True:
+        start = time.time()
+        try:
+            drug = next(drugs)
+        except StopIteration:
+            metrics.record_query('iter_drugs', elapsed + time.time() - start)
+            return
+        elapsed += time.time() - start
+        yield drug
+
+@instrumented
+def drug_by_name(name, source=None):
+    """
+    Return the drug called NAME as a dict, or None.
+    """
+    return reader(source).drug_by_name(name)
+
+@instrumented
+def drugs_by_name(names, source=None):
+    """
+    Return a list of the drugs called NAMES, in the order given.
+    Names with no drug are skipped.
+    """
+    return reader(source).drugs_by_name(names)
+
+@instrumented
+def drug_by_code(code, source=None):
+    """
+    Return the drug with the BNF code CODE as a dict, or None.
+    """
+    return reader(source).drug_by_code(code)
+
+@instrumented
+def drugs_by_code(codes, source=None):
+    """
+    Return {code: drug} for those of CODES that belong to a drug.
+    """
+    return reader(source).drugs_by_code(codes)
+
+@instrumented
+def search_text(term, fields, source=None):
+    """
+    Return the names of drugs whose FIELDS match TERM, using the
+    backend's own text search.
+    """
+    return reader(source).search_text(term, fields)
+
+@instrumented
+def current():
+    """
+    Return (version, source) for the current dataset: its version stamp
+    (None if there isn't one), and what the backend is reading it from.
+    Passing SOURCE to the other functions reads that dataset even once
+    another has been loaded, as long as the backend still holds it.
+    """
+    return backend().current()
+
+@instrumented
+def dataset_version():
+    """
+    Return the version stamp of the current dataset, or None if there
+    isn't one.
+    """
+    return backend().dataset_version()
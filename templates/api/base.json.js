@@ -14,6 +14,14 @@
         {
             "path": "/sideeffects",
             "description": "Side effects search APIs"
+        },
+        {
+            "path": "/sections",
+            "description": "Drug section text search APIs"
+        },
+        {
+            "path": "/interactions",
+            "description": "Drug interaction check APIs"
         }
     ]
 }
\ No newline at end of file
@@ -20,6 +20,46 @@
                             "required": true,
                             "allowMultiple": false,
                             "dataType": "string"
+                        },
+                        {
+                            "name": "limit",
+                            "description": "Maximum number of drugs to return (default 50, at most 500)",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "offset",
+                            "description": "Number of results to skip",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "cursor",
+                            "description": "Resume from this point; the X-Next-Cursor header of the previous page",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
+                        },
+                        {
+                            "name": "stream",
+                            "description": "Set to 1 to stream every result (or up to limit) as it is fetched",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "format",
+                            "description": "Set to ndjson to stream one drug per line",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
                         }
                     ],
                     "errorResponses": [
@@ -58,6 +98,38 @@
                     ]
                 }
             ]
+        },
+        {
+            "path": "/drugs",
+            "description": "OpenBNF Drug entries",
+            "operations": [
+                {
+                    "httpMethod": "GET",
+                    "summary": "Retrieve many drugs by BNF code at once. Returns an object keyed by code, with null for codes that were not found. Also accepts a POST with a JSON list of codes",
+                    "responseClass": "string",
+                    "nickname": "drugCodes",
+                    "parameters": [
+                        {
+                            "name": "codes",
+                            "description": "Comma separated BNF codes (at most 200)",
+                            "paramType": "query",
+                            "required": true,
+                            "allowMultiple": true,
+                            "dataType": "string"
+                        }
+                    ],
+                    "errorResponses": [
+                        {
+                            "code": 400,
+                            "reason": "No codes given"
+                        },
+                        {
+                            "code": 413,
+                            "reason": "Too many codes in one request"
+                        }
+                    ]
+                }
+            ]
         }
 
     ]
@@ -9,17 +9,57 @@
             "operations": [
                 {
                     "httpMethod": "GET",
-                    "summary": "Search for drugs who might be relevant to {indication}",
+                    "summary": "Search for drugs who might be relevant to {indication}, most relevant first",
                     "responseClass": "string",
                     "nickname": "indicationDrugs",
                     "parameters": [
                         {
                             "name": "indication",
-                            "description": "The indication text you would like to search for",
+                            "description": "The indication text you would like to search for. All words must match; use \"quotes\" for phrases and a trailing * for prefixes",
                             "paramType": "query",
                             "required": true,
                             "allowMultiple": false,
                             "dataType": "string"
+                        },
+                        {
+                            "name": "limit",
+                            "description": "Maximum number of drugs to return (default 50, at most 500)",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "offset",
+                            "description": "Number of ranked results to skip",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "cursor",
+                            "description": "Resume from this point; the X-Next-Cursor header of the previous page",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
+                        },
+                        {
+                            "name": "stream",
+                            "description": "Set to 1 to stream every result (or up to limit) as it is fetched",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "format",
+                            "description": "Set to ndjson to stream one drug per line",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
                         }
                     ],
                     "errorResponses": [
@@ -0,0 +1,51 @@
+{
+    "apiVersion": "0.2",
+    "swaggerVersion": "1.1",
+    "basePath": "http://{{host}}/api/v2",
+    "apis": [
+        {
+            "path": "/interactions",
+            "description": "OpenBNF Drug interaction check",
+            "operations": [
+                {
+                    "httpMethod": "GET",
+                    "summary": "Check a list of drugs for interactions with each other. Returns the drugs recognised, those that were not, and every interacting pair with its severity and interaction text. Also accepts a POST with a JSON object of {\"drugs\": [...], \"codes\": [...]}",
+                    "responseClass": "string",
+                    "nickname": "interactionsDrugs",
+                    "parameters": [
+                        {
+                            "name": "drugs",
+                            "description": "Comma separated drug names",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": true,
+                            "dataType": "string"
+                        },
+                        {
+                            "name": "codes",
+                            "description": "Comma separated BNF codes (at most 50 drugs and codes together)",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": true,
+                            "dataType": "string"
+                        }
+                    ],
+                    "errorResponses": [
+                        {
+                            "code": 400,
+                            "reason": "No drugs or codes given"
+                        },
+                        {
+                            "code": 413,
+                            "reason": "Too many drugs in one request"
+                        },
+                        {
+                            "code": 503,
+                            "reason": "The loaded dataset has no interaction data"
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+}
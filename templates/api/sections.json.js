@@ -0,0 +1,83 @@
+{
+    "apiVersion": "0.2",
+    "swaggerVersion": "1.1",
+    "basePath": "http://{{host}}/api/v2",
+    "apis": [
+        {
+            "path": "/sections",
+            "description": "OpenBNF Drug section search",
+            "operations": [
+                {
+                    "httpMethod": "GET",
+                    "summary": "Search the text sections of drugs for {q}, most relevant first",
+                    "responseClass": "string",
+                    "nickname": "sectionsDrugs",
+                    "parameters": [
+                        {
+                            "name": "q",
+                            "description": "The text you would like to search for. All words must match; use \"quotes\" for phrases and a trailing * for prefixes",
+                            "paramType": "query",
+                            "required": true,
+                            "allowMultiple": false,
+                            "dataType": "string"
+                        },
+                        {
+                            "name": "sections",
+                            "description": "Comma separated sections to search: indications, cautions, side-effects, pregnancy (default all)",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
+                        },
+                        {
+                            "name": "limit",
+                            "description": "Maximum number of drugs to return (default 50, at most 500)",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "offset",
+                            "description": "Number of ranked results to skip",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "cursor",
+                            "description": "Resume from this point; the X-Next-Cursor header of the previous page",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
+                        },
+                        {
+                            "name": "stream",
+                            "description": "Set to 1 to stream every result (or up to limit) as it is fetched",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "int"
+                        },
+                        {
+                            "name": "format",
+                            "description": "Set to ndjson to stream one drug per line",
+                            "paramType": "query",
+                            "required": false,
+                            "allowMultiple": false,
+                            "dataType": "string"
+                        }
+                    ],
+                    "errorResponses": [
+                        {
+                            "code": 404,
+                            "reason": "No matching drugs found"
+                        }
+                    ]
+                }
+            ]
+        }
+    ]
+}
\ No newline at end of file
@@ -0,0 +1,11 @@
+"""
+OpenBNF WSGI entry point
+
+This is what production servers run, rather than app.py's development
+server:
+
+    gunicorn -c gunicorn.conf.py wsgi:application
+
+See gunicorn.conf.py and the WEB_ and DB_ settings for tuning.
+"""
+from app import app as application